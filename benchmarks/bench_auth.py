@@ -0,0 +1,141 @@
+"""
+Benchmarks the per request overhead of the authentication decorators and the
+token verification and role mapping behind them, for valid and expired tokens,
+different numbers of roles and with cold and warm caches.
+
+    python benchmarks/bench_auth.py --calls 2000 --json auth.json
+"""
+
+import time
+from pathlib import Path
+
+import jwt
+from flask import Flask
+from harness import measure, parse_args, report
+from werkzeug.exceptions import HTTPException
+
+from fsd_utils.authentication.decorators import login_requested, login_required
+from fsd_utils.authentication.models import User
+from fsd_utils.authentication.utils import _get_highest_role_map, token_cache, validate_token_rs256
+
+KEYS_DIR = Path(__file__).parent.parent / "tests" / "keys" / "rsa256"
+ROLE_COUNTS = (3, 30, 300)
+SUB_ROLES = ("LEAD_ASSESSOR", "ASSESSOR", "COMMENTER")
+
+
+def create_app():
+    app = Flask("benchmark")
+    app.config.update(
+        {
+            "FSD_USER_TOKEN_COOKIE_NAME": "fsd-user-token",
+            "AUTHENTICATOR_HOST": "https://authenticator",
+            "RSA256_PUBLIC_KEY": (KEYS_DIR / "public.pem").read_bytes(),
+        }
+    )
+    return app
+
+
+def _roles(count):
+    return [f"F{index // len(SUB_ROLES)}_{SUB_ROLES[index % len(SUB_ROLES)]}" for index in range(count)]
+
+
+def _token(roles, expires_in=3600):
+    payload = {
+        "accountId": "benchmark-user",
+        "email": "user@communities.gov.uk",
+        "fullName": "Benchmark User",
+        "roles": roles,
+        "exp": int(time.time()) + expires_in,
+    }
+    return jwt.encode(payload, (KEYS_DIR / "private.pem").read_bytes(), algorithm="RS256")
+
+
+def _cold():
+    token_cache.clear()
+    _get_highest_role_map.cache_clear()
+
+
+def _request(app, token, fn):
+    """Run ``fn`` inside a request carrying ``token`` as the auth cookie."""
+
+    def call():
+        with app.test_request_context("/", headers={"Cookie": f"fsd-user-token={token}"}):
+            try:
+                fn()
+            except HTTPException:
+                # Redirects raised by the decorators are the expected result for invalid tokens
+                pass
+
+    return call
+
+
+def bench_validate(app, args):
+    results = []
+    token = _token(_roles(3))
+    with app.app_context():
+
+        def validate():
+            validate_token_rs256(token)
+
+        results.append(measure("validate_token_rs256.cold", validate, args.calls, setup=_cold))
+        results.append(measure("validate_token_rs256.warm", validate, args.calls, warmup=1))
+    return results
+
+
+def bench_roles(args):
+    results = []
+    for count in ROLE_COUNTS:
+        payload = {"email": "user@communities.gov.uk", "fullName": "Benchmark User", "roles": _roles(count)}
+
+        def set_with_token(payload=payload):
+            User.set_with_token(payload)
+
+        results.append(measure(f"user.set_with_token.roles_{count}.cold", set_with_token, args.calls, setup=_cold))
+        results.append(measure(f"user.set_with_token.roles_{count}.warm", set_with_token, args.calls, warmup=1))
+    return results
+
+
+def bench_decorators(app, args):
+    results = []
+
+    @login_required
+    def required_view():
+        return None
+
+    @login_required(roles_required=["F0_COMMENTER"])
+    def required_roles_view():
+        return None
+
+    @login_requested
+    def requested_view():
+        return None
+
+    for count in ROLE_COUNTS:
+        token = _token(_roles(count))
+        view = _request(app, token, required_view)
+        results.append(measure(f"login_required.roles_{count}.cold", view, args.calls, setup=_cold))
+        results.append(measure(f"login_required.roles_{count}.warm", view, args.calls, warmup=1))
+
+    token = _token(_roles(3))
+    results.append(
+        measure("login_required.roles_required.warm", _request(app, token, required_roles_view), args.calls, warmup=1)
+    )
+    results.append(measure("login_requested.warm", _request(app, token, requested_view), args.calls, warmup=1))
+    results.append(measure("login_requested.no_token", _request(app, "", requested_view), args.calls))
+
+    expired_token = _token(_roles(3), expires_in=-60)
+    results.append(measure("login_required.expired", _request(app, expired_token, required_view), args.calls))
+    # Baseline cost of the request context the decorator benchmarks run in
+    results.append(measure("request_context.noop", _request(app, token, lambda: None), args.calls))
+    return results
+
+
+def main(argv=None):
+    args = parse_args(__doc__, argv, calls=2000)
+    app = create_app()
+    results = bench_validate(app, args) + bench_roles(args) + bench_decorators(app, args)
+    report(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmarks the logging pipeline: JSONFormatter and CustomLogFormatter for
+different message shapes, RequestExtraContextFilter and the per request
+overhead of the before_request/after_request logging hooks.
+
+    python benchmarks/bench_logging.py --calls 20000 --json logging.json
+"""
+
+import logging
+import os
+
+from flask import Flask, Response, request
+from harness import measure, parse_args, report
+
+from fsd_utils.logging import logging as fsd_logging
+
+REQUEST_EXTRA = {
+    "method": "GET",
+    "url": "https://frontend.example.com/application/1234?lang=en",
+    "endpoint": "application",
+    "process_": 1234,
+    "thread_": "140245",
+    "status": 200,
+    "duration_real": 0.0123,
+    "duration_process": 0.0101,
+}
+
+# name: (message, extra)
+MESSAGE_SHAPES = {
+    "plain": ("Application submitted", {}),
+    "args": ("Application %s submitted", {}),
+    "extra": ("{method} {url} {status}", REQUEST_EXTRA),
+    "missing_keys": ("{method} {url} {status} {fund} {round}", {"method": "GET"}),
+}
+
+
+def _record(message, extra):
+    args = ("1234",) if "%s" in message else ()
+    record = logging.LogRecord("benchmark", logging.INFO, __file__, 1, message, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def bench_formatters(args):
+    formatters = {
+        "json_formatter": fsd_logging.JSONFormatter(fmt=fsd_logging.get_json_log_format(), serializer="json"),
+        "custom_log_formatter": fsd_logging.CustomLogFormatter(fsd_logging.DEV_DEBUG_LOG_FORMAT),
+    }
+    if fsd_logging.orjson is not None:
+        formatters["json_formatter_orjson"] = fsd_logging.JSONFormatter(
+            fmt=fsd_logging.get_json_log_format(), serializer="orjson"
+        )
+
+    # The missing_keys shape makes the formatters log a warning, discard it rather than print it on every call
+    fsd_logging.logger.addHandler(logging.NullHandler())
+    fsd_logging.logger.propagate = False
+
+    results = []
+    for formatter_name, formatter in formatters.items():
+        for shape, (message, extra) in MESSAGE_SHAPES.items():
+            record = _record(message, extra)
+
+            def format_record(formatter=formatter, record=record):
+                formatter.format(record)
+
+            results.append(measure(f"{formatter_name}.{shape}", format_record, args.calls, warmup=100))
+    return results
+
+
+def _create_app(with_logging):
+    app = Flask("benchmark")
+
+    @app.route("/")
+    def index():
+        return "ok"
+
+    if with_logging:
+        app.config["FSD_LOG_LEVEL"] = "INFO"
+        config = fsd_logging.get_default_logging_config(app)
+        # Write to /dev/null so the benchmark measures the pipeline rather than the terminal
+        config["handlers"]["default"]["stream"] = open(os.devnull, "w")
+        fsd_logging.init_app(app, log_config=config)
+    return app
+
+
+def bench_request_filter(args):
+    app = _create_app(with_logging=False)
+    request_filter = fsd_logging.RequestExtraContextFilter()
+    record = _record(*MESSAGE_SHAPES["plain"])
+
+    def filter_record():
+        request_filter.filter(record)
+
+    results = [measure("request_extra_context_filter.no_request", filter_record, args.calls)]
+    with app.test_request_context("/"):
+        results.append(measure("request_extra_context_filter.no_context", filter_record, args.calls))
+        request.get_extra_log_context = lambda: {"trace_id": "abc123", "user_id": "1234"}
+        results.append(measure("request_extra_context_filter.with_context", filter_record, args.calls))
+    return results
+
+
+def bench_request_hooks(args):
+    results = []
+    for name, with_logging in (("request_hooks.noop", False), ("request_hooks.logging", True)):
+        app = _create_app(with_logging)
+
+        def handle_request(app=app):
+            with app.test_request_context("/"):
+                app.preprocess_request()
+                app.process_response(Response("ok"))
+
+        # The difference between the two is the per request cost of the logging hooks
+        results.append(measure(name, handle_request, args.calls, warmup=100))
+    return results
+
+
+def main(argv=None):
+    args = parse_args(__doc__, argv, calls=20000)
+    results = bench_formatters(args) + bench_request_filter(args) + bench_request_hooks(args)
+    report(results, args)
+
+
+if __name__ == "__main__":
+    main()
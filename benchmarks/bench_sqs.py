@@ -0,0 +1,107 @@
+"""
+Benchmarks the SQSExtendedClient produce, receive and delete paths and the
+TaskExecutorService end to end, against the in-memory SQS and S3 stand-ins.
+
+    python benchmarks/bench_sqs.py --messages 2000 --latency-ms 0 --json sqs.json
+"""
+
+import logging
+
+from flask import Flask
+from harness import measure, parse_args, report
+
+from fsd_test_utils.fakes.aws import InMemoryS3, InMemorySQS
+from fsd_utils.services.aws_extended_client import SQSExtendedClient
+from fsd_utils.sqs_scheduler.context_aware_executor import ContextAwareExecutor
+from fsd_utils.sqs_scheduler.task_executer_service import TaskExecutorService
+
+BUCKET = "benchmark-bucket"
+CREDENTIALS = {
+    "aws_access_key_id": "benchmark",  # pragma: allowlist secret
+    "aws_secret_access_key": "benchmark",  # pragma: allowlist secret
+    "region_name": "eu-west-2",
+}
+
+
+class NoopTaskExecutorService(TaskExecutorService):
+    def message_executor(self, message):
+        return message
+
+
+def _install_fakes(client, latency):
+    client.sqs_client = InMemorySQS(latency=latency)
+    client.s3_client = InMemoryS3(latency=latency)
+    client.s3_client.create_bucket(Bucket=BUCKET)
+    return client.sqs_client.create_queue(QueueName="benchmark")["QueueUrl"]
+
+
+def _fill(client, queue_url, messages):
+    for index in range(messages):
+        client.submit_single_message(queue_url=queue_url, message=f'{{"index": {index}}}')
+
+
+def bench_client(args, latency, logger):
+    client = SQSExtendedClient(
+        large_payload_support=BUCKET, always_through_s3=True, delete_payload_from_s3=True, logger=logger, **CREDENTIALS
+    )
+    queue_url = _install_fakes(client, latency)
+
+    def produce():
+        client.submit_single_message(queue_url=queue_url, message='{"index": 0}')
+
+    results = [measure("sqs_extended.produce", produce, args.messages)]
+
+    batches = args.messages // args.batch_size
+    received = []
+
+    def receive():
+        messages = client.receive_messages(queue_url, args.batch_size, visibility_time=300, wait_time=0)
+        received.append([message["sqs"] for message in messages])
+        return len(messages)
+
+    def delete():
+        return len(client.delete_messages(queue_url, received.pop())["Successful"])
+
+    results.append(measure("sqs_extended.receive", receive, batches))
+    results.append(measure("sqs_extended.delete", delete, batches))
+    return results
+
+
+def bench_task_executor(args, latency):
+    app = Flask("benchmark")
+    app.logger.setLevel(logging.WARNING)
+    service = NoopTaskExecutorService(
+        flask_app=app,
+        executor=ContextAwareExecutor(max_workers=args.workers, thread_name_prefix="Benchmark", flask_app=app),
+        s3_bucket=BUCKET,
+        sqs_primary_url=None,
+        task_executor_max_thread=args.workers,
+        sqs_batch_size=args.batch_size,
+        visibility_time=300,
+        sqs_wait_time=0,
+        **CREDENTIALS,
+    )
+    service.sqs_primary_url = _install_fakes(service.sqs_extended_client, latency)
+    _fill(service.sqs_extended_client, service.sqs_primary_url, args.messages)
+
+    def process():
+        before = service.metrics.processed.value()
+        service.process_messages()
+        return service.metrics.processed.value() - before
+
+    result = measure("task_executor.process_messages", process, args.messages // args.batch_size)
+    service.executor.shutdown()
+    return [result]
+
+
+def main(argv=None):
+    args = parse_args(__doc__, argv, messages=2000, batch_size=10, workers=10, latency_ms=0.0)
+    latency = args.latency_ms / 1000
+    logger = logging.getLogger("benchmark")
+    logger.setLevel(logging.WARNING)
+    results = bench_client(args, latency, logger) + bench_task_executor(args, latency)
+    report(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Minimal benchmark harness shared by the scripts in this directory.
+
+Each benchmark times individual calls with ``time.perf_counter`` and reports
+throughput and p50/p99 call latency. Results can be written to JSON with
+``--json`` and compared against an earlier run with ``--baseline``.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from dataclasses import asdict, dataclass
+
+# fsd_utils.config needs FLASK_ENV at import time, the benchmark scripts import this module first
+os.environ.setdefault("FLASK_ENV", "unit_test")
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    calls: int
+    items: int
+    seconds: float
+    items_per_second: float
+    p50_ms: float
+    p99_ms: float
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(name, fn, calls, warmup=0, setup=None):
+    """Time ``calls`` invocations of ``fn``.
+
+    :param fn: Callable run once per call, returns the number of items it handled (None counts as 1).
+    :param warmup: Untimed calls made first.
+    :param setup: Optional untimed callable run before every call.
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    latencies = []
+    items = 0
+    for _ in range(calls):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        handled = fn()
+        latencies.append(time.perf_counter() - start)
+        items += 1 if handled is None else handled
+    latencies.sort()
+    total = sum(latencies)
+    return BenchmarkResult(
+        name=name,
+        calls=calls,
+        items=items,
+        seconds=total,
+        items_per_second=items / total if total else 0.0,
+        p50_ms=percentile(latencies, 0.5) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+    )
+
+
+def parse_args(description, argv=None, **defaults):
+    """Common command line options, ``defaults`` adds integer options."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--json", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results previously written with --json")
+    for option, default in defaults.items():
+        parser.add_argument(f"--{option.replace('_', '-')}", type=type(default), default=default)
+    return parser.parse_args(argv)
+
+
+def report(results, args):
+    """Print the results, compare them with the baseline and write them as JSON."""
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = {result["name"]: result for result in json.load(baseline_file)["results"]}
+
+    print(f"{'benchmark':<40} {'items/s':>12} {'p50 ms':>10} {'p99 ms':>10} {'vs baseline':>12}")
+    for result in results:
+        change = ""
+        if result.name in baseline and baseline[result.name]["items_per_second"]:
+            ratio = result.items_per_second / baseline[result.name]["items_per_second"]
+            change = f"{(ratio - 1) * 100:+.1f}%"
+        print(
+            f"{result.name:<40} {result.items_per_second:>12.1f} {result.p50_ms:>10.3f} "
+            f"{result.p99_ms:>10.3f} {change:>12}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(
+                {
+                    "python": sys.version.split()[0],
+                    "platform": platform.platform(),
+                    "results": [asdict(result) for result in results],
+                },
+                json_file,
+                indent=2,
+            )
@@ -1,3 +1,3 @@
-from fsd_test_utils import fixtures, test_config
+from fsd_test_utils import fakes, fixtures, test_config
 
-__all__ = [fixtures, test_config]
+__all__ = [fakes, fixtures, test_config]
@@ -0,0 +1,434 @@
+"""
+Thread-safe in-memory stand-ins for the parts of the boto3 SQS and S3 clients
+used by fsd_utils.services, for tests and benchmarks that should not need AWS.
+
+Usage:
+
+    client = SQSExtendedClient(..., large_payload_support="bucket", always_through_s3=True)
+    client.sqs_client = InMemorySQS()
+    client.s3_client = InMemoryS3()
+    client.s3_client.create_bucket(Bucket="bucket")
+"""
+
+import hashlib
+import io
+import json
+import threading
+import time
+from uuid import uuid4
+
+from botocore.exceptions import ClientError
+
+FIFO_DEDUPLICATION_INTERVAL = 300
+# Most entries SQS accepts in a batch request, and messages in a single receive
+MAX_BATCH_ENTRIES = 10
+
+
+def _response(status_code=200, **kwargs):
+    return {**kwargs, "ResponseMetadata": {"HTTPStatusCode": status_code}}
+
+
+def _client_error(code, message, operation_name):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation_name)
+
+
+def _validate_batch(entries, operation_name):
+    if not entries:
+        raise _client_error(
+            "AWS.SimpleQueueService.EmptyBatchRequest",
+            "There should be at least one entry in the request.",
+            operation_name,
+        )
+    if len(entries) > MAX_BATCH_ENTRIES:
+        raise _client_error(
+            "AWS.SimpleQueueService.TooManyEntriesInBatchRequest",
+            f"Maximum number of entries per request are {MAX_BATCH_ENTRIES}. You have sent {len(entries)}.",
+            operation_name,
+        )
+
+
+class _LatencyInjector:
+    def __init__(self, latency):
+        """:latency seconds to sleep before every call, a dict of seconds per
+        operation name, or a callable taking the operation name."""
+        self.latency = latency
+
+    def __call__(self, operation_name):
+        if not self.latency:
+            return
+        if callable(self.latency):
+            delay = self.latency(operation_name)
+        elif isinstance(self.latency, dict):
+            delay = self.latency.get(operation_name, 0)
+        else:
+            delay = self.latency
+        if delay:
+            time.sleep(delay)
+
+
+class _Message:
+    def __init__(self, body, message_attributes, group_id, deduplication_id, visible_at):
+        self.message_id = str(uuid4())
+        self.body = body
+        self.md5_of_body = hashlib.md5(body.encode("utf-8")).hexdigest()
+        self.message_attributes = message_attributes or {}
+        self.sent_timestamp = str(int(time.time() * 1000))
+        self.group_id = group_id
+        self.deduplication_id = deduplication_id
+        self.visible_at = visible_at
+        self.receive_count = 0
+        self.receipt_handle = None
+
+    def to_response(self, attribute_names, message_attribute_names):
+        attributes = {
+            "SentTimestamp": self.sent_timestamp,
+            "ApproximateReceiveCount": str(self.receive_count),
+        }
+        if self.group_id:
+            attributes["MessageGroupId"] = self.group_id
+        if self.deduplication_id:
+            attributes["MessageDeduplicationId"] = self.deduplication_id
+        if "All" not in attribute_names:
+            attributes = {name: value for name, value in attributes.items() if name in attribute_names}
+        message = {
+            "MessageId": self.message_id,
+            "ReceiptHandle": self.receipt_handle,
+            "MD5OfBody": self.md5_of_body,
+            "Body": self.body,
+        }
+        if attributes:
+            message["Attributes"] = attributes
+        if {"All", ".*"} & set(message_attribute_names):
+            message_attributes = self.message_attributes
+        else:
+            message_attributes = {
+                name: value for name, value in self.message_attributes.items() if name in message_attribute_names
+            }
+        if message_attributes:
+            message["MessageAttributes"] = message_attributes
+        return message
+
+
+class _Queue:
+    def __init__(self, name, url, arn, attributes):
+        self.name = name
+        self.url = url
+        self.arn = arn
+        self.attributes = dict(attributes or {})
+        self.fifo = self.attributes.get("FifoQueue") == "true" or name.endswith(".fifo")
+        self.messages = {}
+        self.receipt_handles = {}
+        self.deduplication_ids = {}
+
+    @property
+    def visibility_timeout(self):
+        return int(self.attributes.get("VisibilityTimeout", 30))
+
+    @property
+    def redrive_policy(self):
+        if "RedrivePolicy" in self.attributes:
+            return json.loads(self.attributes["RedrivePolicy"])
+        return None
+
+
+class InMemorySQS:
+    """Implements the SQS client calls made by SQSClient and SQSExtendedClient,
+    with visibility timeouts, receive counts, FIFO message groups and
+    deduplication, redrive to a dead letter queue and long polling. Only
+    the latest receipt handle of a message deletes it."""
+
+    def __init__(self, latency=None, region_name="eu-west-2", account_id="000000000000", clock=time.monotonic):
+        """:latency see _LatencyInjector :clock monotonic clock used for
+        visibility timeouts."""
+        self.region_name = region_name
+        self.account_id = account_id
+        self._latency = _LatencyInjector(latency)
+        self._clock = clock
+        self._queues = {}
+        self._condition = threading.Condition()
+
+    def create_queue(self, QueueName, Attributes=None, **kwargs):
+        self._latency("create_queue")
+        with self._condition:
+            url = f"https://sqs.{self.region_name}.amazonaws.com/{self.account_id}/{QueueName}"
+            if url not in self._queues:
+                arn = f"arn:aws:sqs:{self.region_name}:{self.account_id}:{QueueName}"
+                self._queues[url] = _Queue(QueueName, url, arn, Attributes)
+            return _response(QueueUrl=url)
+
+    def delete_queue(self, QueueUrl):
+        self._latency("delete_queue")
+        with self._condition:
+            self._get_queue(QueueUrl, "DeleteQueue")
+            del self._queues[QueueUrl]
+            return _response()
+
+    def purge_queue(self, QueueUrl):
+        self._latency("purge_queue")
+        with self._condition:
+            queue = self._get_queue(QueueUrl, "PurgeQueue")
+            queue.messages.clear()
+            queue.receipt_handles.clear()
+            return _response()
+
+    def list_queues(self, QueueNamePrefix=""):
+        self._latency("list_queues")
+        with self._condition:
+            urls = [queue.url for queue in self._queues.values() if queue.name.startswith(QueueNamePrefix)]
+            return _response(QueueUrls=urls)
+
+    def get_queue_url(self, QueueName):
+        self._latency("get_queue_url")
+        with self._condition:
+            for queue in self._queues.values():
+                if queue.name == QueueName:
+                    return _response(QueueUrl=queue.url)
+        raise _client_error("AWS.SimpleQueueService.NonExistentQueue", QueueName, "GetQueueUrl")
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=("All",)):
+        self._latency("get_queue_attributes")
+        with self._condition:
+            queue = self._get_queue(QueueUrl, "GetQueueAttributes")
+            now = self._clock()
+            visible = sum(1 for message in queue.messages.values() if message.visible_at <= now)
+            attributes = {
+                **queue.attributes,
+                "QueueArn": queue.arn,
+                "ApproximateNumberOfMessages": str(visible),
+                "ApproximateNumberOfMessagesNotVisible": str(len(queue.messages) - visible),
+            }
+            if "All" not in AttributeNames:
+                attributes = {name: value for name, value in attributes.items() if name in AttributeNames}
+            return _response(Attributes=attributes)
+
+    def set_queue_attributes(self, QueueUrl, Attributes):
+        self._latency("set_queue_attributes")
+        with self._condition:
+            self._get_queue(QueueUrl, "SetQueueAttributes").attributes.update(Attributes)
+            return _response()
+
+    def send_message(
+        self,
+        QueueUrl,
+        MessageBody,
+        MessageAttributes=None,
+        MessageGroupId=None,
+        MessageDeduplicationId=None,
+        DelaySeconds=0,
+    ):
+        self._latency("send_message")
+        with self._condition:
+            queue = self._get_queue(QueueUrl, "SendMessage")
+            message_id = self._enqueue(
+                queue, MessageBody, MessageAttributes, MessageGroupId, MessageDeduplicationId, DelaySeconds
+            )
+            self._condition.notify_all()
+            return _response(
+                MessageId=message_id,
+                MD5OfMessageBody=hashlib.md5(MessageBody.encode("utf-8")).hexdigest(),
+            )
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self._latency("send_message_batch")
+        _validate_batch(Entries, "SendMessageBatch")
+        with self._condition:
+            queue = self._get_queue(QueueUrl, "SendMessageBatch")
+            successful = []
+            for entry in Entries:
+                message_id = self._enqueue(
+                    queue,
+                    entry["MessageBody"],
+                    entry.get("MessageAttributes"),
+                    entry.get("MessageGroupId"),
+                    entry.get("MessageDeduplicationId"),
+                    entry.get("DelaySeconds", 0),
+                )
+                successful.append({"Id": entry["Id"], "MessageId": message_id})
+            self._condition.notify_all()
+            return _response(Successful=successful)
+
+    def receive_message(
+        self,
+        QueueUrl,
+        AttributeNames=(),
+        MessageAttributeNames=(),
+        MaxNumberOfMessages=1,
+        VisibilityTimeout=None,
+        WaitTimeSeconds=0,
+        **kwargs,
+    ):
+        self._latency("receive_message")
+        if not 1 <= MaxNumberOfMessages <= MAX_BATCH_ENTRIES:
+            raise _client_error(
+                "InvalidParameterValue",
+                f"Value {MaxNumberOfMessages} for parameter MaxNumberOfMessages is invalid. "
+                f"Reason: Must be between 1 and {MAX_BATCH_ENTRIES}, if provided.",
+                "ReceiveMessage",
+            )
+        deadline = time.monotonic() + (WaitTimeSeconds or 0)
+        with self._condition:
+            while True:
+                queue = self._get_queue(QueueUrl, "ReceiveMessage")
+                messages = self._take_visible(queue, MaxNumberOfMessages, VisibilityTimeout)
+                remaining = deadline - time.monotonic()
+                if messages or remaining <= 0:
+                    break
+                # Hidden messages become visible without a notification, so poll in short slices
+                self._condition.wait(min(remaining, 0.05))
+            response = [message.to_response(AttributeNames, MessageAttributeNames) for message in messages]
+        if response:
+            return _response(Messages=response)
+        return _response()
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self._latency("delete_message_batch")
+        _validate_batch(Entries, "DeleteMessageBatch")
+        with self._condition:
+            queue = self._get_queue(QueueUrl, "DeleteMessageBatch")
+            successful, failed = [], []
+            for entry in Entries:
+                message_id = queue.receipt_handles.pop(entry["ReceiptHandle"], None)
+                if message_id is None:
+                    failed.append({"Id": entry["Id"], "Code": "ReceiptHandleIsInvalid", "SenderFault": True})
+                    continue
+                message = queue.messages.get(message_id)
+                # Like SQS, a receipt handle from before the latest receive succeeds without deleting the message
+                if message is not None and message.receipt_handle == entry["ReceiptHandle"]:
+                    del queue.messages[message_id]
+                successful.append({"Id": entry["Id"]})
+            response = {"Successful": successful}
+            if failed:
+                response["Failed"] = failed
+            return _response(**response)
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self._latency("change_message_visibility_batch")
+        _validate_batch(Entries, "ChangeMessageVisibilityBatch")
+        with self._condition:
+            queue = self._get_queue(QueueUrl, "ChangeMessageVisibilityBatch")
+            now = self._clock()
+            successful, failed = [], []
+            for entry in Entries:
+                message = queue.messages.get(queue.receipt_handles.get(entry["ReceiptHandle"]))
+                if message is None:
+                    failed.append({"Id": entry["Id"], "Code": "ReceiptHandleIsInvalid", "SenderFault": True})
+                    continue
+                message.visible_at = now + entry["VisibilityTimeout"]
+                successful.append({"Id": entry["Id"]})
+            self._condition.notify_all()
+            response = {"Successful": successful}
+            if failed:
+                response["Failed"] = failed
+            return _response(**response)
+
+    def _get_queue(self, queue_url, operation_name):
+        queue = self._queues.get(queue_url)
+        if queue is None:
+            raise _client_error("AWS.SimpleQueueService.NonExistentQueue", queue_url, operation_name)
+        return queue
+
+    def _enqueue(self, queue, body, message_attributes, group_id, deduplication_id, delay_seconds):
+        now = self._clock()
+        if queue.fifo:
+            if not group_id:
+                raise _client_error("MissingParameter", "MessageGroupId is required", "SendMessage")
+            if deduplication_id:
+                known = queue.deduplication_ids.get(deduplication_id)
+                if known and known[1] > now:
+                    return known[0]
+        message = _Message(body, message_attributes, group_id, deduplication_id, now + (delay_seconds or 0))
+        queue.messages[message.message_id] = message
+        if queue.fifo and deduplication_id:
+            queue.deduplication_ids[deduplication_id] = (message.message_id, now + FIFO_DEDUPLICATION_INTERVAL)
+        return message.message_id
+
+    def _take_visible(self, queue, max_number, visibility_timeout):
+        now = self._clock()
+        if visibility_timeout is None:
+            visibility_timeout = queue.visibility_timeout
+        redrive_policy = queue.redrive_policy
+        blocked_groups = set()
+        if queue.fifo:
+            blocked_groups = {m.group_id for m in queue.messages.values() if m.receive_count and m.visible_at > now}
+        taken = []
+        for message in list(queue.messages.values()):
+            if len(taken) >= max_number:
+                break
+            if message.visible_at > now or message.group_id in blocked_groups:
+                continue
+            if redrive_policy and message.receive_count >= int(redrive_policy["maxReceiveCount"]):
+                self._move_to_dead_letter_queue(queue, message, redrive_policy["deadLetterTargetArn"])
+                continue
+            message.receive_count += 1
+            message.receipt_handle = str(uuid4())
+            message.visible_at = now + visibility_timeout
+            queue.receipt_handles[message.receipt_handle] = message.message_id
+            if queue.fifo:
+                blocked_groups.add(message.group_id)
+            taken.append(message)
+        return taken
+
+    def _move_to_dead_letter_queue(self, queue, message, dead_letter_arn):
+        del queue.messages[message.message_id]
+        for dead_letter_queue in self._queues.values():
+            if dead_letter_queue.arn == dead_letter_arn:
+                message.visible_at = self._clock()
+                dead_letter_queue.messages[message.message_id] = message
+                return
+
+
+class _StreamingBody:
+    def __init__(self, data):
+        self._raw = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self._raw.read(amt)
+
+
+class InMemoryS3:
+    """Implements the S3 client calls made by SQSExtendedClient."""
+
+    def __init__(self, latency=None):
+        """:latency see _LatencyInjector."""
+        self._latency = _LatencyInjector(latency)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def create_bucket(self, Bucket, **kwargs):
+        self._latency("create_bucket")
+        with self._lock:
+            self._buckets.setdefault(Bucket, {})
+            return _response(Location=f"/{Bucket}")
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        self._latency("put_object")
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        with self._lock:
+            self._get_bucket(Bucket, "PutObject")[Key] = bytes(Body)
+            return _response(ETag=f'"{hashlib.md5(Body).hexdigest()}"')
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._latency("get_object")
+        with self._lock:
+            objects = self._get_bucket(Bucket, "GetObject")
+            if Key not in objects:
+                raise _client_error("NoSuchKey", Key, "GetObject")
+            data = objects[Key]
+        return _response(Body=_StreamingBody(data), ContentLength=len(data))
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._latency("delete_object")
+        with self._lock:
+            self._get_bucket(Bucket, "DeleteObject").pop(Key, None)
+        return _response(204)
+
+    def list_object_keys(self, Bucket):
+        """Not part of the boto3 API, returns the keys stored in a bucket."""
+        with self._lock:
+            return list(self._get_bucket(Bucket, "ListObjects"))
+
+    def _get_bucket(self, bucket, operation_name):
+        if bucket not in self._buckets:
+            raise _client_error("NoSuchBucket", bucket, operation_name)
+        return self._buckets[bucket]
@@ -13,6 +13,7 @@ config_var_auth_host = "AUTHENTICATOR_HOST"
 config_var_logout_url_override = "LOGOUT_URL_OVERRIDE"
 config_var_user_token_cookie_name = "FSD_USER_TOKEN_COOKIE_NAME"
 config_var_rs256_public_key = "RSA256_PUBLIC_KEY"
+config_var_rs256_public_keys = "RSA256_PUBLIC_KEYS"
 signout_route = "/sessions/sign-out"
 user_route = "/service/user"
 
@@ -1,3 +1,5 @@
+import asyncio
+import inspect
 from functools import wraps
 from typing import List
 from urllib.parse import urlencode
@@ -6,7 +8,7 @@ from flask import Request, abort, current_app, g, redirect, request
 from jwt import ExpiredSignatureError, PyJWTError
 from werkzeug.exceptions import HTTPException
 
-from fsd_utils.authentication.utils import validate_token_rs256
+from fsd_utils.authentication.utils import get_cached_token_payload, validate_token_rs256
 
 from .config import (
     InternalDomain,
@@ -19,6 +21,8 @@ from .config import (
 )
 from .models import User
 
+_INTERNAL_DOMAINS = tuple(domain.value for domain in InternalDomain)
+
 
 def _failed_redirect(return_app: SupportedApp | None):
     logout_url = _build_logout_url(return_app)
@@ -47,20 +51,45 @@ def _check_access_token(return_app: SupportedApp | None = None, auto_redirect=Tr
             -- If auto_redirect is True then issue a _failed_redirect()
             -- If auto_redirect is False then return False
     """
-    user_token_cookie_name = current_app.config[config_var_user_token_cookie_name]
-
-    login_cookie = request.cookies.get(user_token_cookie_name)
+    login_cookie = _get_login_cookie()
     if not login_cookie:
-        if auto_redirect:
-            _failed_redirect(return_app)
-        return False
+        return _failed_access_token(return_app, auto_redirect)
 
     try:
         return validate_token_rs256(login_cookie)
     except (PyJWTError, ExpiredSignatureError):
-        if auto_redirect:
-            _failed_redirect(return_app)
-        return False
+        return _failed_access_token(return_app, auto_redirect)
+
+
+async def _check_access_token_async(return_app: SupportedApp | None = None, auto_redirect=True):
+    """
+    Async version of _check_access_token. Tokens that are not already
+    cached are verified in a worker thread so the signature check does
+    not block the event loop.
+    """
+    login_cookie = _get_login_cookie()
+    if not login_cookie:
+        return _failed_access_token(return_app, auto_redirect)
+
+    try:
+        token_payload = get_cached_token_payload(login_cookie)
+        if token_payload is None:
+            # to_thread copies the context, so current_app is still available to the worker
+            token_payload = await asyncio.to_thread(validate_token_rs256, login_cookie)
+        return token_payload
+    except (PyJWTError, ExpiredSignatureError):
+        return _failed_access_token(return_app, auto_redirect)
+
+
+def _get_login_cookie():
+    user_token_cookie_name = current_app.config[config_var_user_token_cookie_name]
+    return request.cookies.get(user_token_cookie_name)
+
+
+def _failed_access_token(return_app: SupportedApp | None, auto_redirect):
+    if auto_redirect:
+        _failed_redirect(return_app)
+    return False
 
 
 def _build_return_path(request: Request):
@@ -103,24 +132,45 @@ def login_required(f=None, roles_required: List[str] = None, return_app: Support
     if f is None:
         return lambda f: login_required(f=f, roles_required=roles_required, return_app=return_app)
 
-    @wraps(f)
-    def _wrapper(*args, **kwargs):
-        try:
-            token_payload = _check_access_token(return_app=return_app)
-            g.account_id = token_payload.get("accountId")
-            g.user = User.set_with_token(token_payload)
-        except HTTPException as e:
+    required_role_set = frozenset(roles_required or ())
+
+    def _authorise(token_payload):
+        if isinstance(token_payload, HTTPException):
             if current_app.config.get("FLASK_ENV") == "development" and current_app.config.get("DEBUG_USER_ON"):
                 g.account_id = current_app.config.get("DEBUG_USER_ACCOUNT_ID")
                 g.user = User(**current_app.config.get("DEBUG_USER"))
             else:
-                raise e
+                raise token_payload
+        else:
+            g.account_id = token_payload.get("accountId")
+            g.user = User.set_with_token(token_payload)
 
         g.logout_url = _build_logout_url(return_app)
         g.is_authenticated = True
-        if roles_required:
-            if not any(role_required in g.user.roles for role_required in roles_required):
+        if required_role_set:
+            if not g.user.has_any_role(required_role_set):
                 _failed_roles_redirect(roles_required, source_app=return_app)
+
+    if inspect.iscoroutinefunction(f):
+
+        @wraps(f)
+        async def _async_wrapper(*args, **kwargs):
+            try:
+                token_payload = await _check_access_token_async(return_app=return_app)
+            except HTTPException as e:
+                token_payload = e
+            _authorise(token_payload)
+            return await f(*args, **kwargs)
+
+        return _async_wrapper
+
+    @wraps(f)
+    def _wrapper(*args, **kwargs):
+        try:
+            token_payload = _check_access_token(return_app=return_app)
+        except HTTPException as e:
+            token_payload = e
+        _authorise(token_payload)
         return f(*args, **kwargs)
 
     return _wrapper
@@ -139,32 +189,55 @@ def login_requested(f):
     variable to False and the g.account_id to None
     """
 
+    if inspect.iscoroutinefunction(f):
+
+        @wraps(f)
+        async def decorated_async(*args, **kwargs):
+            _set_requested_user(await _check_access_token_async(auto_redirect=False))
+            return await f(*args, **kwargs)
+
+        return decorated_async
+
     @wraps(f)
     def decorated(*args, **kwargs):
-        token_payload = _check_access_token(auto_redirect=False)
-        authenticator_host = current_app.config[config_var_auth_host]
-        g.logout_url = authenticator_host + signout_route
-        if token_payload and isinstance(token_payload, dict):
-            g.account_id = token_payload.get("accountId")
-            g.user = User.set_with_token(token_payload)
-            g.is_authenticated = True
-        else:
-            g.account_id = None
-            g.is_authenticated = False
+        _set_requested_user(_check_access_token(auto_redirect=False))
         return f(*args, **kwargs)
 
     return decorated
 
 
+def _set_requested_user(token_payload):
+    authenticator_host = current_app.config[config_var_auth_host]
+    g.logout_url = authenticator_host + signout_route
+    if token_payload and isinstance(token_payload, dict):
+        g.account_id = token_payload.get("accountId")
+        g.user = User.set_with_token(token_payload)
+        g.is_authenticated = True
+    else:
+        g.account_id = None
+        g.is_authenticated = False
+
+
 def check_internal_user(func):
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def decorated_async(*args, **kwargs):
+            _check_internal_user()
+            return await func(*args, **kwargs)
+
+        return decorated_async
+
     @wraps(func)
     def decorated(*args, **kwargs):
-        internal_domains = tuple(k.value for k in InternalDomain)
-        authenticated = g.is_authenticated
-        is_communities = g.is_authenticated and g.user.email.endswith(internal_domains)
-        if not authenticated or is_communities:
-            return func(*args, **kwargs)
-        else:
-            abort(403)
+        _check_internal_user()
+        return func(*args, **kwargs)
 
     return decorated
+
+
+def _check_internal_user():
+    authenticated = g.is_authenticated
+    is_communities = g.is_authenticated and g.user.email.endswith(_INTERNAL_DOMAINS)
+    if authenticated and not is_communities:
+        abort(403)
@@ -3,38 +3,110 @@ Data models for authentication
 """
 
 from dataclasses import dataclass
-from os import getenv
-from typing import List, Mapping
+from typing import Iterable, Mapping
 
-from sentry_sdk import set_user
+from flask import g, has_app_context
 
 from .utils import get_highest_role_map
 
 
-@dataclass
+class Roles(list):
+    """
+    The user's roles in their original order, with constant time membership
+    checks backed by a frozenset that is rebuilt whenever the list changes.
+    """
+
+    __slots__ = ("_role_set",)
+
+    def __init__(self, roles: Iterable[str] = ()):
+        super().__init__(roles)
+        self._role_set = frozenset(self)
+
+    def __contains__(self, role):
+        return role in self._role_set
+
+    def has_any(self, roles: Iterable[str]) -> bool:
+        return not self._role_set.isdisjoint(roles)
+
+    def has_all(self, roles: Iterable[str]) -> bool:
+        return self._role_set.issuperset(roles)
+
+
+def _keep_role_set_in_step(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args):
+        result = method(self, *args)
+        self._role_set = frozenset(self)
+        return result
+
+    wrapper.__name__ = wrapper.__qualname__ = name
+    return wrapper
+
+
+# The list methods that can add or remove roles
+_LIST_MUTATORS = (
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "remove",
+    "pop",
+    "clear",
+)
+
+for _name in _LIST_MUTATORS:
+    setattr(Roles, _name, _keep_role_set_in_step(_name))
+
+
+@dataclass(frozen=True, slots=True)
 class User:
     full_name: str
     email: str
-    roles: List[str]
+    roles: Roles
     highest_role_map: Mapping[str, str]
 
+    def __post_init__(self):
+        if not isinstance(self.roles, Roles):
+            object.__setattr__(self, "roles", Roles(self.roles or ()))
+
+    def has_role(self, role: str) -> bool:
+        return role in self.roles
+
+    def has_any_role(self, roles: Iterable[str]) -> bool:
+        return self.roles.has_any(roles)
+
+    def has_all_roles(self, roles: Iterable[str]) -> bool:
+        return self.roles.has_all(roles)
+
     @classmethod
     def set_with_token(cls, token_payload):
         full_name = token_payload.get("fullName")
         email = token_payload.get("email")
         roles = token_payload.get("roles")
-        # Set user in Sentry
-        if getenv("SENTRY_DSN"):
-            set_user(
-                {
-                    "email": token_payload.get("email"),
-                    "id": token_payload.get("accountId"),
-                    "username": token_payload.get("fullName"),
-                }
-            )
+        # The Sentry user is added lazily by _add_user_to_sentry_event when an event is captured
         return cls(
             full_name=full_name,
             email=email,
             roles=roles,
             highest_role_map=get_highest_role_map(roles),
         )
+
+
+def _add_user_to_sentry_event(event, hint):
+    """
+    Sentry event processor that tags events with the authenticated user from
+    the Flask g object, so building the Sentry user only happens when an
+    event is actually sent. Registered by init_sentry.
+    """
+    if has_app_context():
+        user = g.get("user")
+        if isinstance(user, User):
+            event_user = event.setdefault("user", {})
+            event_user.setdefault("email", user.email)
+            event_user.setdefault("id", g.get("account_id"))
+            event_user.setdefault("username", user.full_name)
+    return event
@@ -1,18 +1,163 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Mapping
 
 import jwt as jwt
 from flask import current_app
+from jwt.algorithms import RSAAlgorithm
 
-from .config import config_var_rs256_public_key
+from .config import config_var_rs256_public_key, config_var_rs256_public_keys
+
+TOKEN_CACHE_MAX_SIZE = 1024
+# Tokens without an exp claim never expire, so bound how long their verification is trusted
+TOKEN_CACHE_TTL_WITHOUT_EXP = 300
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of verified token payloads, keyed by a digest of the
+    token so raw tokens are not kept in memory. Entries expire at the token's
+    exp claim and the whole cache is flushed when the verification key changes.
+    """
+
+    def __init__(self, max_size=TOKEN_CACHE_MAX_SIZE, clock=time.time):
+        self.max_size = max_size
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._key = None
+        self._lock = threading.Lock()
+
+    def get(self, token, key):
+        digest = self._digest(token)
+        with self._lock:
+            if key != self._key:
+                return None
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if self._clock() >= expires_at:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return dict(payload)
+
+    def set(self, token, key, payload):
+        if not self.max_size:
+            return
+        exp = payload.get("exp")
+        expires_at = exp if isinstance(exp, (int, float)) else self._clock() + TOKEN_CACHE_TTL_WITHOUT_EXP
+        digest = self._digest(token)
+        with self._lock:
+            if key != self._key:
+                self._entries.clear()
+                self._key = key
+            self._entries[digest] = (dict(payload), expires_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._key = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _digest(token):
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        return hashlib.sha256(token).digest()
+
+
+class PublicKeySet:
+    """
+    Parsed public keys indexed by the key id (kid) tokens carry in their
+    header, with a default key for tokens that have no or an unknown kid.
+    """
+
+    def __init__(self, default_key=None, keys_by_kid=None):
+        self.default_key = default_key
+        self.keys_by_kid = keys_by_kid or {}
+
+    def get(self, kid=None):
+        key = self.keys_by_kid.get(kid, self.default_key) if kid is not None else self.default_key
+        if key is None:
+            raise jwt.InvalidKeyError(f"No public key configured for kid {kid}")
+        return key
+
+
+class PublicKeyLoader:
+    """
+    Parses the configured PEM public keys into key objects once and reuses
+    them until the configuration changes, so PyJWT does not re-parse a PEM on
+    every decode.
+    """
+
+    def __init__(self, algorithm=None):
+        self._algorithm = algorithm or RSAAlgorithm(RSAAlgorithm.SHA256)
+        # (pem, pems_by_kid, key_set) replaced as a whole so concurrent readers never see a mismatched set
+        self._loaded = (None, None, PublicKeySet())
+
+    def load(self, pem, pems_by_kid=None):
+        """
+        :param pem: The default PEM public key
+        :param pems_by_kid: Optional mapping (or JSON object string) of kid to PEM public key
+        :return: A PublicKeySet
+        """
+        loaded_pem, loaded_pems_by_kid, key_set = self._loaded
+        if self._unchanged(pem, loaded_pem) and self._unchanged(pems_by_kid, loaded_pems_by_kid):
+            return key_set
+        keys_by_kid = json.loads(pems_by_kid) if isinstance(pems_by_kid, str) else (pems_by_kid or {})
+        key_set = PublicKeySet(
+            default_key=self._algorithm.prepare_key(pem) if pem else None,
+            keys_by_kid={kid: self._algorithm.prepare_key(key) for kid, key in keys_by_kid.items()},
+        )
+        self._loaded = (pem, pems_by_kid, key_set)
+        return key_set
+
+    @staticmethod
+    def _unchanged(value, loaded_value):
+        return value is loaded_value or value == loaded_value
+
+
+token_cache = TokenCache()
+rs256_public_key_loader = PublicKeyLoader()
 
 
 def _validate_token(token, key, algorithms):
     return jwt.decode(token, key, algorithms=algorithms)
 
 
+def _load_rs256_key_set():
+    return rs256_public_key_loader.load(
+        current_app.config.get(config_var_rs256_public_key),
+        current_app.config.get(config_var_rs256_public_keys),
+    )
+
+
+def get_cached_token_payload(token):
+    """
+    Return the payload of a token that has already been verified
+    against the current keys, or None if it has to be verified again.
+    """
+    return token_cache.get(token, _load_rs256_key_set())
+
+
 def validate_token_rs256(token):
-    key = current_app.config.get(config_var_rs256_public_key)
-    return _validate_token(token, key, algorithms=["RS256"])
+    key_set = _load_rs256_key_set()
+    payload = token_cache.get(token, key_set)
+    if payload is None:
+        kid = jwt.get_unverified_header(token).get("kid")
+        payload = _validate_token(token, key_set.get(kid), algorithms=["RS256"])
+        token_cache.set(token, key_set, payload)
+    return payload
 
 
 _ROLE_HIERARCHY = [
@@ -20,23 +165,28 @@ _ROLE_HIERARCHY = [
     "ASSESSOR",
     "COMMENTER",
 ]
+_ROLE_RANK = {role: rank for rank, role in enumerate(_ROLE_HIERARCHY)}
+_ROLES_WITH_FUND_PREFIX = tuple(f"_{role}" for role in _ROLE_HIERARCHY)
+ROLE_MAP_CACHE_MAX_SIZE = 1024
 
 
 def get_highest_role_map(roles: list[str]) -> Mapping[str, str]:
-    roles_with_fund_prefix = tuple(f"_{rh}" for rh in _ROLE_HIERARCHY)
-    filtered_roles = [r for r in roles if r.endswith(roles_with_fund_prefix)]
+    # Copy so callers can't modify the memoized result. Keyed on the tuple rather than a set
+    # so the map's keys keep the order of the roles, whatever the hash seed
+    return dict(_get_highest_role_map(tuple(roles)))
 
-    fund_short_name_to_roles_list = {}
-    for role in filtered_roles:
-        fund_short_name, sub_role = role.split("_", 1)
-        if fund_short_name in fund_short_name_to_roles_list:
-            fund_short_name_to_roles_list[fund_short_name].append(sub_role)
-        else:
-            fund_short_name_to_roles_list[fund_short_name] = [sub_role]
 
+@lru_cache(maxsize=ROLE_MAP_CACHE_MAX_SIZE)
+def _get_highest_role_map(roles: tuple[str, ...]) -> Mapping[str, str]:
     fund_short_name_to_highest_role = {}
-    for fund_short_name, roles_list in fund_short_name_to_roles_list.items():
-        highest_role, *_ = sorted(roles_list, key=lambda x: _ROLE_HIERARCHY.index(x))
-        fund_short_name_to_highest_role[fund_short_name] = highest_role
-
+    for role in roles:
+        if not role.endswith(_ROLES_WITH_FUND_PREFIX):
+            continue
+        fund_short_name, sub_role = role.split("_", 1)
+        rank = _ROLE_RANK.get(sub_role)
+        if rank is None:
+            continue
+        highest_role = fund_short_name_to_highest_role.get(fund_short_name)
+        if highest_role is None or rank < _ROLE_RANK[highest_role]:
+            fund_short_name_to_highest_role[fund_short_name] = sub_role
     return fund_short_name_to_highest_role
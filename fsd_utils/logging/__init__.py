@@ -1,2 +1,3 @@
 # flake8: noqa
 from . import logging
+from . import timing
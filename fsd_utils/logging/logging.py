@@ -1,27 +1,61 @@
 from __future__ import absolute_import
 
+import atexit
 import datetime
+import json
 import logging
+import queue
+import random
 import re
+import string
+import sys
+import threading
 import time
+import weakref
+from collections import OrderedDict, deque
+from functools import lru_cache
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
 from os import getpid
 from threading import get_ident as get_thread_ident
 
 from flask import Flask, current_app, request
 from flask.ctx import has_request_context
 
+from fsd_utils.logging.timing import get_request_spans
+
 try:
+    from pythonjsonlogger.json import JsonEncoder
     from pythonjsonlogger.json import JsonFormatter as BaseJSONFormatter
 except ImportError:
+    from pythonjsonlogger.jsonlogger import JsonEncoder
     from pythonjsonlogger.jsonlogger import JsonFormatter as BaseJSONFormatter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Log formats can use any attributes available in
 # https://docs.python.org/3/library/logging.html#logrecord-attributes
 LOG_FORMAT = "%(name)s %(levelname)s - %(message)s - from %(funcName)s in %(pathname)s:%(lineno)d"
 
 _DEFAULT_FSD_LOG_LEVEL = "INFO"
 
+_DEFAULT_FSD_LOG_QUEUE_SIZE = 10000
+
+_DEFAULT_FSD_LOG_REQUEST_SAMPLE_RATE = 1.0
+
+_DEFAULT_FSD_LOG_SLOW_REQUEST_SECONDS = None
+
+MESSAGE_TEMPLATE_CACHE_SIZE = 1024
+
+_REQUEST_RECEIVED_LOG_MESSAGE = "Received request {method} {url}"
+_REQUEST_LOG_MESSAGE = "{method} {url} {status}"
+_SLOW_REQUEST_LOG_MESSAGE = "Slow request {method} {url} {status}"
+# Every request log shares one of these messages and call sites, so rate limiting them would drop all but one
+_REQUEST_LOG_MESSAGES = frozenset((_REQUEST_RECEIVED_LOG_MESSAGE, _REQUEST_LOG_MESSAGE, _SLOW_REQUEST_LOG_MESSAGE))
+
 DEV_DEBUG_LOG_FORMAT = "%(asctime)s %(levelname)s - %(message)s - from %(funcName)s() in %(filename)s:%(lineno)d"
 
 
@@ -54,18 +88,84 @@ def _common_request_extra_log_context():
     }
 
 
+def _request_extra_log_context():
+    """
+    The common request log context, built once per request and cached on
+    the request so the before and after request logs can share it.
+    """
+    context = getattr(request, "common_extra_log_context", None)
+    if context is None:
+        context = request.common_extra_log_context = _common_request_extra_log_context()
+    return context
+
+
 def get_default_logging_config(app: Flask):
     log_level = app.config.get("FSD_LOG_LEVEL", _DEFAULT_FSD_LOG_LEVEL)
     formatter = "plaintext" if app.config.get("FLASK_ENV") == "development" else "json"
 
+    default_handler = {
+        "filters": ["request_extra_context"],
+        "formatter": formatter,
+        "class": "logging.StreamHandler",
+        "stream": "ext://sys.stdout",
+    }
+    logger_level = log_level
+    if debug_capture_size := app.config.get("FSD_LOG_DEBUG_CAPTURE"):
+        # Keep records below FSD_LOG_LEVEL per request and only write them out for failed requests
+        default_handler = {
+            "()": "fsd_utils.logging.logging.DebugCaptureHandler",
+            "filters": ["request_extra_context"],
+            "formatter": formatter,
+            "stream": "ext://sys.stdout",
+            "capacity": debug_capture_size,
+            "emit_level": log_level,
+        }
+        if app.config.get("FSD_LOG_ASYNC"):
+            default_handler["queue_size"] = app.config.get("FSD_LOG_QUEUE_SIZE", _DEFAULT_FSD_LOG_QUEUE_SIZE)
+        logger_level = "DEBUG"
+    elif app.config.get("FSD_LOG_ASYNC"):
+        # Format and write records on a background thread so a slow stdout doesn't block requests
+        default_handler = {
+            "()": "fsd_utils.logging.logging.NonBlockingQueueHandler",
+            "filters": ["request_extra_context"],
+            "formatter": formatter,
+            "stream": "ext://sys.stdout",
+            "queue_size": app.config.get("FSD_LOG_QUEUE_SIZE", _DEFAULT_FSD_LOG_QUEUE_SIZE),
+        }
+
+    filters = {
+        "request_extra_context": {
+            "()": "fsd_utils.logging.logging.RequestExtraContextFilter",
+        },
+    }
+    loggers = {
+        "": {
+            "handlers": ["null"],
+        },
+        "werkzeug": {
+            "disabled": True,
+        },
+        app.name: {
+            "handlers": ["default"],
+            "level": logger_level,
+        },
+    }
+    rate_limits = app.config.get("FSD_LOG_RATE_LIMITS")
+    if rate_limits:
+        # A single number applies to the app's logger
+        if not isinstance(rate_limits, dict):
+            rate_limits = {app.name: rate_limits}
+        filters["rate_limit"] = {
+            "()": "fsd_utils.logging.logging.RateLimitingFilter",
+            "interval": dict(rate_limits),
+        }
+        # On the handler rather than the loggers, as a logger's filters don't see the records of its children
+        default_handler["filters"] = default_handler["filters"] + ["rate_limit"]
+
     return {
         "version": 1,
         "disable_existing_loggers": False,
-        "filters": {
-            "request_extra_context": {
-                "()": "fsd_utils.logging.logging.RequestExtraContextFilter",
-            },
-        },
+        "filters": filters,
         "formatters": {
             "plaintext": {
                 "()": "fsd_utils.logging.logging.CustomLogFormatter",
@@ -74,31 +174,16 @@ def get_default_logging_config(app: Flask):
             "json": {
                 "()": "fsd_utils.logging.logging.JSONFormatter",
                 "fmt": get_json_log_format(),
+                "serializer": app.config.get("FSD_LOG_JSON_SERIALIZER", "auto"),
             },
         },
         "handlers": {
             "null": {
                 "class": "logging.NullHandler",
             },
-            "default": {
-                "filters": ["request_extra_context"],
-                "formatter": formatter,
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stdout",
-            },
-        },
-        "loggers": {
-            "": {
-                "handlers": ["null"],
-            },
-            "werkzeug": {
-                "disabled": True,
-            },
-            app.name: {
-                "handlers": ["default"],
-                "level": log_level,
-            },
+            "default": default_handler,
         },
+        "loggers": loggers,
     }
 
 
@@ -111,6 +196,17 @@ def init_app(app, log_config: dict | None = None):
 
 
 def attach_request_loggers(app):
+    """
+    Log each request. Successful requests are logged for a random
+    FSD_LOG_REQUEST_SAMPLE_RATE fraction of requests (all of them by
+    default), while error responses and, if FSD_LOG_SLOW_REQUEST_SECONDS
+    is set, requests slower than it are always logged. Slow requests are
+    logged as warnings, and any spans recorded with
+    fsd_utils.logging.timing are included in the log.
+    """
+    sample_rate = app.config.get("FSD_LOG_REQUEST_SAMPLE_RATE", _DEFAULT_FSD_LOG_REQUEST_SAMPLE_RATE)
+    slow_request_seconds = app.config.get("FSD_LOG_SLOW_REQUEST_SECONDS", _DEFAULT_FSD_LOG_SLOW_REQUEST_SECONDS)
+
     @app.before_request
     def before_request():
         # annotating these onto request instead of flask.g as they probably
@@ -118,33 +214,55 @@ def attach_request_loggers(app):
         request.before_request_real_time = time.perf_counter()
         request.before_request_process_time = time.process_time()
 
-        current_app.logger.log(
-            logging.DEBUG,
-            "Received request {method} {url}",
-            extra=_common_request_extra_log_context(),
-        )
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.log(
+                logging.DEBUG,
+                _REQUEST_RECEIVED_LOG_MESSAGE,
+                extra=_request_extra_log_context(),
+            )
 
     @app.after_request
     def after_request(response):
-        if request.path != "/healthcheck":
-            current_app.logger.log(
-                logging.INFO,
-                "{method} {url} {status}",
-                extra={
-                    "status": response.status_code,
-                    "duration_real": (
-                        (time.perf_counter() - request.before_request_real_time)
-                        if hasattr(request, "before_request_real_time")
-                        else None
-                    ),
-                    "duration_process": (
-                        (time.process_time() - request.before_request_process_time)
-                        if hasattr(request, "before_request_process_time")
-                        else None
-                    ),
-                    **_common_request_extra_log_context(),
-                },
-            )
+        if response.status_code >= 500:
+            flush_debug_capture()
+        if request.path == "/healthcheck":
+            return response
+
+        duration_real = (
+            (time.perf_counter() - request.before_request_real_time)
+            if hasattr(request, "before_request_real_time")
+            else None
+        )
+        is_slow = (
+            slow_request_seconds is not None and duration_real is not None and duration_real >= slow_request_seconds
+        )
+        if not current_app.logger.isEnabledFor(logging.WARNING if is_slow else logging.INFO):
+            return response
+        # Error responses and slow requests are always logged
+        is_sampled = response.status_code < 400 and not is_slow and sample_rate < 1
+        if is_sampled and random.random() >= sample_rate:
+            return response
+
+        extra = {
+            "status": response.status_code,
+            "duration_real": duration_real,
+            "duration_process": (
+                (time.process_time() - request.before_request_process_time)
+                if hasattr(request, "before_request_process_time")
+                else None
+            ),
+            **_request_extra_log_context(),
+        }
+        if spans := get_request_spans():
+            extra["spans"] = dict(spans)
+        if is_sampled:
+            extra["sample_rate"] = sample_rate
+        if is_slow:
+            # Flag slow requests so they stand out, with the spans showing where the time went
+            extra["slow"] = True
+            current_app.logger.log(logging.WARNING, _SLOW_REQUEST_LOG_MESSAGE, extra=extra)
+        else:
+            current_app.logger.log(logging.INFO, _REQUEST_LOG_MESSAGE, extra=extra)
         return response
 
 
@@ -152,9 +270,223 @@ def get_json_log_format():
     return LOG_FORMAT + "".join(f" %({key})s" for key in LOG_FORMAT_EXTRA_JSON_KEYS)
 
 
+_json_encoder_default = JsonEncoder().default
+
+
+def json_serializer(log_record):
+    return json.dumps(log_record, cls=JsonEncoder)
+
+
+def orjson_serializer(log_record):
+    try:
+        return orjson.dumps(log_record, default=_json_encoder_default, option=orjson.OPT_NON_STR_KEYS).decode()
+    except TypeError:
+        # orjson.JSONEncodeError is a TypeError, raised for eg. integers wider than 64 bits
+        return json_serializer(log_record)
+
+
+JSON_SERIALIZERS = {
+    "json": json_serializer,
+    "orjson": orjson_serializer,
+}
+
+
+def get_json_serializer(serializer="auto"):
+    """
+    :param serializer: "auto" to use orjson when it is installed and the
+        standard library otherwise, "json", "orjson" or a callable that
+        takes the log record dict and returns a str
+    """
+    if callable(serializer):
+        return serializer
+    if serializer == "auto":
+        serializer = "orjson" if orjson is not None else "json"
+    if serializer == "orjson" and orjson is None:
+        raise ImportError("The orjson log serializer needs the orjson package installed")
+    try:
+        return JSON_SERIALIZERS[serializer]
+    except KeyError:
+        raise ValueError(f"Unknown log serializer {serializer!r}") from None
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to a background thread which formats them and writes
+    them to `stream`, so logging calls never block on the stream.
+
+    The queue is bounded. Once it is `debug_headroom` full DEBUG records
+    are dropped so the remaining space is kept for more important ones,
+    and when it is completely full records of any level are dropped. The
+    number of dropped records is logged as a warning once the queue is
+    back below that mark.
+
+    Filters run on the logging thread, so request context is still
+    available to them; the formatter runs on the background thread.
+    """
+
+    def __init__(self, stream=None, queue_size=_DEFAULT_FSD_LOG_QUEUE_SIZE, debug_headroom=0.8):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.target = logging.StreamHandler(stream)
+        self.debug_limit = int(queue_size * debug_headroom) if queue_size > 0 else 0
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._start_listener()
+
+    def _start_listener(self):
+        self._pid = getpid()
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+
+    def _is_listening(self):
+        return self.listener._thread is not None and self._pid == getpid()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Unlike QueueHandler, leave formatting to the target handler on the listener thread
+        return record
+
+    def enqueue(self, record):
+        if self._pid != getpid():
+            # The listener thread doesn't survive a fork, e.g. into a gunicorn worker
+            self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self._start_listener()
+
+        if self.debug_limit and record.levelno <= logging.DEBUG and self.queue.qsize() >= self.debug_limit:
+            self._record_dropped()
+            return
+
+        if self.dropped and self.queue.qsize() < (self.debug_limit or self.queue.maxsize):
+            self._enqueue_dropped_warning(record)
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._record_dropped()
+
+    def _record_dropped(self):
+        with self._dropped_lock:
+            self.dropped += 1
+
+    def _enqueue_dropped_warning(self, record):
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        warning = logging.LogRecord(
+            record.name,
+            logging.WARNING,
+            __file__,
+            0,
+            "Dropped %d log records because the log queue was full",
+            (dropped,),
+            None,
+        )
+        try:
+            self.queue.put_nowait(warning)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += dropped
+
+    def flush(self):
+        """Wait for the records queued so far to be written."""
+        if self._is_listening():
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        if self._is_listening():
+            self.listener.stop()
+        self.target.close()
+        super().close()
+
+
+class DebugCaptureHandler(logging.Handler):
+    """
+    Writes records at or above `emit_level` straight away and keeps the
+    last `capacity` records below it for each request in a ring buffer.
+    The buffered records are only written, marked with `debug_capture`,
+    if an ERROR is logged during the request or it ends with a 5xx
+    response, so failed requests come with their debug context.
+
+    Filters run when a record is logged, so buffered records still carry
+    the request context added by RequestExtraContextFilter.
+    """
+
+    def __init__(
+        self,
+        stream=None,
+        capacity=100,
+        emit_level=_DEFAULT_FSD_LOG_LEVEL,
+        flush_level=logging.ERROR,
+        queue_size=None,
+    ):
+        """
+        :param queue_size: write through a NonBlockingQueueHandler with this
+            queue size instead of directly to `stream`
+        """
+        super().__init__()
+        if queue_size:
+            self.target = NonBlockingQueueHandler(stream=stream, queue_size=queue_size)
+        else:
+            self.target = logging.StreamHandler(stream)
+        self.capacity = capacity
+        self.emit_level = logging._checkLevel(emit_level)
+        self.flush_level = logging._checkLevel(flush_level)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def emit(self, record):
+        if record.levelno >= self.emit_level:
+            if record.levelno >= self.flush_level:
+                self.flush_captured()
+            self.target.handle(record)
+        elif has_request_context():
+            buffers = getattr(request, "debug_capture_buffers", None)
+            if buffers is None:
+                buffers = request.debug_capture_buffers = {}
+            buffer = buffers.get(self)
+            if buffer is None:
+                buffer = buffers[self] = deque(maxlen=self.capacity)
+            buffer.append(record)
+
+    def flush_captured(self):
+        """Write the records captured so far for the current request."""
+        if not has_request_context():
+            return
+        buffer = getattr(request, "debug_capture_buffers", {}).get(self)
+        while buffer:
+            record = buffer.popleft()
+            record.debug_capture = True
+            self.target.handle(record)
+
+    def flush(self):
+        self.target.flush()
+
+    def close(self):
+        self.target.close()
+        super().close()
+
+
+def flush_debug_capture():
+    """Write the debug records captured for the current request by every DebugCaptureHandler."""
+    for handler in list(getattr(request, "debug_capture_buffers", {})):
+        handler.flush_captured()
+
+
 class BaseExtraStackLocationFilter(logging.Filter):
+    # The interesting-or-not decision is cached per code object, subclasses whose
+    # is_interesting_frame depends on more than the frame's code should disable this
+    cache_frame_decisions = True
+    frame_decision_cache_size = 4096
+    # Frames beyond this many above the call to filter() are not searched
+    max_stack_depth = 100
+
     def __init__(self, param_prefix):
         self._param_prefix = param_prefix
+        self._frame_decisions = {}
 
     def is_interesting_frame(self, frame):
         raise NotImplementedError
@@ -162,6 +494,14 @@ class BaseExtraStackLocationFilter(logging.Filter):
     def enabled_for_record(self, record):
         return True
 
+    def _is_interesting_frame(self, frame):
+        try:
+            # do this in a try block to protect ourselves from
+            # faulty is_interesting_frame implementations
+            return bool(self.is_interesting_frame(frame))
+        except:  # noqa
+            return False
+
     def _findCaller(self):
         """
         Cut down copy of Python 3.6.6's logging.Logger.findCaller()
@@ -169,20 +509,26 @@ class BaseExtraStackLocationFilter(logging.Filter):
         Find the stack frame of the caller so that we can note the source
         file name, line number and function name.
         """
-        f = logging.currentframe()
-        if f is not None:
-            f = f.f_back
-        while hasattr(f, "f_code"):
+        # Start from the caller of filter() rather than logging.currentframe(),
+        # which skips a different number of frames on different Python versions
+        f = sys._getframe(2)
+        frame_decisions = self._frame_decisions if self.cache_frame_decisions else None
+        depth = 0
+        while hasattr(f, "f_code") and depth < self.max_stack_depth:
             co = f.f_code
-            try:
-                # do this in a try block to protect ourselves from
-                # faulty is_interesting_frame implementations
-                is_interesting_frame = self.is_interesting_frame(f)
-            except:  # noqa
-                is_interesting_frame = False
+            if frame_decisions is None:
+                is_interesting_frame = self._is_interesting_frame(f)
+            else:
+                is_interesting_frame = frame_decisions.get(co)
+                if is_interesting_frame is None:
+                    is_interesting_frame = self._is_interesting_frame(f)
+                    if len(frame_decisions) >= self.frame_decision_cache_size:
+                        frame_decisions.clear()
+                    frame_decisions[co] = is_interesting_frame
             if is_interesting_frame:
                 return co.co_filename, f.f_lineno, co.co_name
             f = f.f_back
+            depth += 1
         return None, None, None
 
     def filter(self, record):
@@ -210,6 +556,164 @@ class BaseExtraStackLocationFilter(logging.Filter):
         return record
 
 
+class RateLimitingFilter(logging.Filter):
+    """
+    Collapses repeated records from the same call site, eg. a mapping
+    helper logging the same error for every bad answer in an export.
+    Only the first `burst` records at `level` or above from each call site
+    are let through per `interval` seconds. Once a window in which records
+    were dropped has closed, a summary record is logged through the same
+    logger with the last dropped message and a `suppressed_count`. Closed
+    windows are checked for whenever a record is filtered, and every
+    outstanding count is logged when the process exits, so a flood that
+    stops is still reported. The request logs from attach_request_loggers
+    are never limited.
+
+    `interval` can also be a dict of logger name to seconds, to only limit
+    those loggers and the loggers under them, with the most specific name
+    applying. Add the filter to a handler rather than a logger so it sees
+    the records of child loggers.
+    """
+
+    SUMMARY_MESSAGE = "%s [repeated %d more times]"
+
+    def __init__(self, interval=60, level=logging.WARNING, burst=1, max_call_sites=1024, clock=time.monotonic):
+        super().__init__()
+        self.interval = interval
+        self._intervals = dict(interval) if isinstance(interval, dict) else None
+        # logger name -> interval of its most specific configured name, or None if it isn't limited
+        self._logger_intervals = {}
+        self.level = logging._checkLevel(level)
+        self.burst = burst
+        self.max_call_sites = max_call_sites
+        self._clock = clock
+        # call site -> [window end, records let through, records suppressed, last suppressed record]
+        self._call_sites = OrderedDict()
+        # Earliest end of a window with suppressed records, None when there are none
+        self._next_summary_at = None
+        self._lock = threading.Lock()
+        _rate_limiting_filters.add(self)
+
+    def filter(self, record):
+        if getattr(record, "rate_limit_summary", False):
+            return True
+        if self._next_summary_at is not None and self._clock() >= self._next_summary_at:
+            self.flush_summaries()
+        if record.levelno < self.level:
+            return True
+        interval = self._get_interval(record.name)
+        if interval is None:
+            return True
+        if isinstance(record.msg, str):
+            if record.msg in _REQUEST_LOG_MESSAGES:
+                return True
+            msg = record.msg
+        else:
+            msg = type(record.msg)
+        call_site = (record.name, record.pathname, record.lineno, record.levelno, msg)
+        now = self._clock()
+        with self._lock:
+            state = self._call_sites.get(call_site)
+            if state is None or now >= state[0]:
+                ended = self._start_window(call_site, state, now + interval)
+            elif state[1] < self.burst:
+                state[1] += 1
+                return True
+            else:
+                state[2] += 1
+                state[3] = record
+                if self._next_summary_at is None or state[0] < self._next_summary_at:
+                    self._next_summary_at = state[0]
+                return False
+
+        # Report what was dropped from this call site before its next record
+        self._log_summaries(ended)
+        return True
+
+    def _start_window(self, call_site, state, window_end):
+        """
+        Start a new window for the call site, returning the ended or
+        evicted windows that still have suppressed records to report.
+        Must be called with the lock held.
+        """
+        ended = [state] if state is not None and state[2] else []
+        self._call_sites[call_site] = [window_end, 1, 0, None]
+        self._call_sites.move_to_end(call_site)
+        while len(self._call_sites) > self.max_call_sites:
+            _, evicted = self._call_sites.popitem(last=False)
+            if evicted[2]:
+                ended.append(evicted)
+        return ended
+
+    def flush_summaries(self, force=False):
+        """
+        Log a summary for every call site whose window has closed with
+        suppressed records, or for all of them if `force` is set.
+        """
+        now = self._clock()
+        states = []
+        next_summary_at = None
+        with self._lock:
+            for state in self._call_sites.values():
+                if not state[2]:
+                    continue
+                if force or now >= state[0]:
+                    states.append(state)
+                elif next_summary_at is None or state[0] < next_summary_at:
+                    next_summary_at = state[0]
+            self._next_summary_at = next_summary_at
+        self._log_summaries(states)
+
+    def _log_summaries(self, states):
+        for state in states:
+            with self._lock:
+                suppressed, state[2] = state[2], 0
+                record, state[3] = state[3], None
+            if not suppressed:
+                continue
+            try:
+                message = record.getMessage()
+            except Exception:
+                message = str(record.msg)
+            summary = logging.LogRecord(
+                record.name,
+                record.levelno,
+                record.pathname,
+                record.lineno,
+                self.SUMMARY_MESSAGE,
+                (message, suppressed),
+                None,
+                record.funcName,
+            )
+            summary.suppressed_count = suppressed
+            summary.rate_limit_summary = True
+            logging.getLogger(record.name).handle(summary)
+
+    def _get_interval(self, logger_name):
+        if self._intervals is None:
+            return self.interval
+        try:
+            return self._logger_intervals[logger_name]
+        except KeyError:
+            pass
+        name = logger_name
+        while name and name not in self._intervals:
+            name = name.rpartition(".")[0]
+        interval = self._intervals.get(name)
+        self._logger_intervals[logger_name] = interval
+        return interval
+
+
+_rate_limiting_filters = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_rate_limiting_summaries():
+    # Registered after logging's own shutdown hook, so this runs before the handlers are closed
+    for rate_limiting_filter in list(_rate_limiting_filters):
+        rate_limiting_filter.flush_summaries(force=True)
+
+
 class RequestExtraContextFilter(logging.Filter):
     """
     Filter which will pull extra context from
@@ -232,7 +736,7 @@ class CustomLogFormatter(logging.Formatter):
     with console colouring option
     """
 
-    FORMAT_STRING_FIELDS_PATTERN = re.compile(r"\((.+?)\)")
+    FORMAT_STRING_FIELDS_PATTERN = re.compile(r"%\((.+?)\)")
     GREY = "\x1b[38;20m"
     YELLOW = "\x1b[33;20m"
     RED = "\x1b[31;20m😠"
@@ -251,35 +755,36 @@ class CustomLogFormatter(logging.Formatter):
         date_strftime_format = "%d-%b-%y %H:%M:%S"
         logging.Formatter.__init__(self, msg, datefmt=date_strftime_format)
         self.use_color = use_color
+        # `_fmt` never changes, so find its fields and colour the level names once up front
+        self._fields = tuple(self.FORMAT_STRING_FIELDS_PATTERN.findall(self._fmt))
+        self._coloured_levelnames = {
+            levelname: colour + levelname + self.RESET for levelname, colour in self.COLOURS.items()
+        }
 
-    def add_fields(self, record):
+    def field_values(self, record):
         """
-        Ensure all values found in our `fmt`
-        have non-None entries in `record`
+        Values for all fields found in our `fmt`, with "-" in place of
+        missing or None entries in `record`. The record itself is left
+        untouched so it can be passed on to other handlers.
         """
-        # FIXME: This method mutates the log record's `levelname` attribute, which `colour_field` does a lookup on.
-        #        This means if the log record is processed by two handlers, we get an error, because the second
-        #        handler doesn't recognise the ANSI-encoded levelname. For now, we only process logs through a single
-        #        handler - if this changes, beware, we'll be in uncharted (broken) territory.
-        for field in self.FORMAT_STRING_FIELDS_PATTERN.findall(self._fmt):
-            # slightly clunky - this is so we catch
-            # explicitly-set Nones too and turn them into "-"
-            fetched_value = record.__dict__.get(field)
-            string_value = fetched_value if fetched_value is not None else "-"
-            if self.use_color and field == "levelname":
-                string_value = self.colour_field(record, string_value)
-            record.__dict__[field] = string_value
-
-    def colour_field(self, record, msg):
-        color = self.COLOURS.get(record.levelname)
-        return color + msg + self.RESET
-
-    def format(self, record):
-        self.add_fields(record)
-        msg = super(CustomLogFormatter, self).format(record)
-
+        values = {}
+        for field in self._fields:
+            value = record.__dict__.get(field)
+            values[field] = value if value is not None else "-"
+        if "message" in values:
+            values["message"] = self.format_message(values["message"], record)
+        if self.use_color and "levelname" in values:
+            values["levelname"] = self.colour_levelname(values["levelname"])
+        return values
+
+    def colour_levelname(self, levelname):
+        return self._coloured_levelnames.get(levelname, levelname)
+
+    def format_message(self, message, record):
+        if not isinstance(message, str) or ("{" not in message and "}" not in message):
+            return message
         try:
-            msg = msg.format(**record.__dict__)
+            return message.format_map(record.__dict__)
         except:  # noqa
             # We know that KeyError, ValueError and IndexError are all
             # possible things that can go wrong here - there is no guarantee
@@ -293,18 +798,31 @@ class CustomLogFormatter(logging.Formatter):
             # written to the logs, and that might be important info such as an
             # exception.
             #
-            # NB do not attempt to log either the exception or `msg` here,
+            # NB do not attempt to log either the exception or `message` here,
             # or you will find that too fails, and you end up with an
             # infinite recursion / stack overflow.
             logger.info("failed to format log message")
+            return message
 
-        return msg
+    def formatMessage(self, record):
+        return self._fmt % self.field_values(record)
 
 
 class JSONFormatter(BaseJSONFormatter):
-    def __init__(self, *args, max_missing_key_attempts=5, **kwargs):
+    # python-json-logger options that only apply to its own json.dumps based serialization
+    _JSON_DUMPS_OPTIONS = ("json_default", "json_encoder", "json_serializer", "json_indent", "json_ensure_ascii")
+
+    def __init__(self, *args, max_missing_key_attempts=5, serializer="auto", **kwargs):
         super().__init__(*args, **kwargs)
         self._max_missing_key_attempts = max_missing_key_attempts
+        if serializer == "auto" and any(option in kwargs for option in self._JSON_DUMPS_OPTIONS):
+            serializer = None
+        self._serializer = get_json_serializer(serializer) if serializer else None
+
+    def jsonify_log_record(self, log_record):
+        if self._serializer is None:
+            return super().jsonify_log_record(log_record)
+        return self._serializer(log_record)
 
     def formatTime(self, record, datefmt: str | None = ...) -> str:
         ct = self.converter(record.created)
@@ -318,39 +836,70 @@ class JSONFormatter(BaseJSONFormatter):
             )
         return s
 
+    _RENAMED_KEYS = (
+        ("asctime", "time"),
+        ("trace_id", "requestId"),
+    )
+
     def process_log_record(self, log_record):
-        for key, newkey in (
-            (
-                "asctime",
-                "time",
-            ),
-            (
-                "trace_id",
-                "requestId",
-            ),
-        ):
-            try:
+        for key, newkey in self._RENAMED_KEYS:
+            if key in log_record:
                 log_record[newkey] = log_record.pop(key)
-            except KeyError:
-                pass
 
         log_record["logType"] = "application"
 
-        missing_keys = {}
-        for _ in range(self._max_missing_key_attempts):
-            try:
-                log_record["message"] = log_record["message"].format(**log_record, **missing_keys)
-            except KeyError as e:
-                missing_keys[e.args[0]] = f"{{{e.args[0]}: missing key}}"
-            else:
-                # execution should only ever reach this point once
-                # - when the .format() succeeds
-                if missing_keys:
-                    logger.warning("Missing keys when formatting log message: %s", tuple(missing_keys.keys()))
+        message = log_record.get("message")
+        if isinstance(message, str) and ("{" in message or "}" in message):
+            log_record["message"] = self._format_message(message, log_record)
+
+        return log_record
 
-                break
+    def _format_message(self, message, log_record):
+        field_names = _parse_message_template(message)
+        if field_names is None:
+            return message
+
+        missing_keys = [field_name for field_name in field_names if field_name not in log_record]
+        if len(missing_keys) >= self._max_missing_key_attempts:
+            logger.error("Too many missing keys when attempting to format log message: gave up")
+            return message
+        if missing_keys:
+            logger.warning("Missing keys when formatting log message: %s", tuple(missing_keys))
+
+        return message.format_map(
+            {
+                field_name: log_record[field_name] if field_name in log_record else f"{{{field_name}: missing key}}"
+                for field_name in field_names
+            }
+        )
 
-        else:
-            logger.exception("Too many missing keys when attempting to format log message: gave up")
 
-        return log_record
+_FIELD_NAME_PATTERN = re.compile(r"[^.\[]*")
+
+
+@lru_cache(maxsize=MESSAGE_TEMPLATE_CACHE_SIZE)
+def _parse_message_template(template):
+    """
+    Return the names of the fields a str.format template refers to, so a
+    message only has to be parsed once however often it is logged.
+    Returns None if the template can't be formatted with named fields,
+    in which case the message is logged as is.
+    """
+    field_names = {}
+    try:
+        for _, field_name, format_spec, _ in string.Formatter().parse(template):
+            if field_name is None:
+                continue
+            # Only the part before any attribute or index lookup is a key, eg. "request" in "request.url"
+            name = _FIELD_NAME_PATTERN.match(field_name).group()
+            if not name or name.isdigit():
+                return None
+            field_names[name] = None
+            if format_spec and "{" in format_spec:
+                nested_field_names = _parse_message_template(format_spec)
+                if nested_field_names is None:
+                    return None
+                field_names.update(dict.fromkeys(nested_field_names))
+    except ValueError:
+        return None
+    return tuple(field_names)
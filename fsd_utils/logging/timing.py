@@ -0,0 +1,142 @@
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import request
+from flask.ctx import has_request_context
+
+_SERVER_TIMING_NAME_PATTERN = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+
+def record_span(name, duration):
+    """
+    Add `duration` seconds to the named span of the current request, eg.
+    "db", "http" or "render". Spans with the same name are summed. Does
+    nothing outside a request.
+    """
+    if not has_request_context():
+        return
+    spans = getattr(request, "timing_spans", None)
+    if spans is None:
+        spans = request.timing_spans = {}
+    spans[name] = spans.get(name, 0.0) + duration
+
+
+@contextmanager
+def span(name):
+    """
+    Time the enclosed block as part of the named span of the current request:
+
+        with span("db"):
+            db.session.execute(...)
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def get_request_spans():
+    """The spans recorded for the current request, as a dict of name to seconds."""
+    if not has_request_context():
+        return {}
+    return getattr(request, "timing_spans", None) or {}
+
+
+def format_server_timing(spans, total=None):
+    """
+    Build a Server-Timing header value from a dict of span name to seconds,
+    eg. 'db;dur=12.5, total;dur=20.1'.
+    """
+    metrics = [
+        f"{_SERVER_TIMING_NAME_PATTERN.sub('_', name)};dur={duration * 1000:.1f}" for name, duration in spans.items()
+    ]
+    if total is not None:
+        metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+class EndpointLatencySummary(object):
+    """
+    Rolling latency summary per endpoint over each endpoint's last
+    `window` requests.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, duration):
+        durations = self._durations.get(endpoint)
+        if durations is None:
+            with self._lock:
+                durations = self._durations.setdefault(endpoint, deque(maxlen=self.window))
+        # deque.append is atomic, so recording doesn't need the lock
+        durations.append(duration)
+
+    def summary(self):
+        """
+        :return: dict of endpoint to count and p50/p95/p99/max latency in
+            seconds over the window
+        """
+        with self._lock:
+            endpoints = list(self._durations.items())
+        result = {}
+        for endpoint, durations in endpoints:
+            ordered = sorted(durations)
+            if not ordered:
+                continue
+            result[endpoint] = {
+                "count": len(ordered),
+                "p50": _percentile(ordered, 0.5),
+                "p95": _percentile(ordered, 0.95),
+                "p99": _percentile(ordered, 0.99),
+                "max": ordered[-1],
+            }
+        return result
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class RequestTiming(object):
+    """
+    Adds a Server-Timing header with the spans recorded during a request
+    and the total request time, and optionally keeps a rolling per
+    endpoint latency summary. Builds on the request start time recorded by
+    fsd_utils.logging, which also logs slow requests with their spans.
+    """
+
+    def __init__(self, app, server_timing_header=True, endpoint_latency_window=0):
+        """
+        :param server_timing_header: add the Server-Timing response header
+        :param endpoint_latency_window: number of recent requests per
+            endpoint to keep in the latency summary, 0 to disable it
+        """
+        self.flask_app = app
+        self.server_timing_header = server_timing_header
+        self.endpoint_latency = EndpointLatencySummary(endpoint_latency_window) if endpoint_latency_window else None
+        app.extensions["fsd_request_timing"] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        if not hasattr(request, "before_request_real_time"):
+            request.before_request_real_time = time.perf_counter()
+
+    def _after_request(self, response):
+        # Missing if an earlier before_request handler returned a response
+        start = getattr(request, "before_request_real_time", None)
+        total = time.perf_counter() - start if start is not None else None
+        if self.server_timing_header:
+            server_timing = format_server_timing(get_request_spans(), total)
+            if server_timing:
+                response.headers.add("Server-Timing", server_timing)
+        if self.endpoint_latency is not None and total is not None and request.endpoint:
+            self.endpoint_latency.record(request.endpoint, total)
+        return response
@@ -0,0 +1,3 @@
+from . import endpoint_metrics  # noqa
+from . import multiprocess  # noqa
+from . import registry  # noqa
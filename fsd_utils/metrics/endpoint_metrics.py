@@ -0,0 +1,62 @@
+import atexit
+import time
+
+from flask import Response, request
+
+from fsd_utils.metrics.multiprocess import MultiProcessCollector
+from fsd_utils.metrics.registry import DEFAULT_BUCKETS, MetricsRegistry
+
+
+class EndpointMetrics(object):
+    """Records a latency histogram and response status counts per endpoint
+    and serves them in the Prometheus text format on ``/metrics``.
+
+    Under gunicorn each worker has its own metrics, so set
+    ``multiprocess_dir`` (or ``FSD_METRICS_MULTIPROCESS_DIR``) to a directory
+    shared by the workers to have ``/metrics`` report all of them."""
+
+    def __init__(self, app, path="/metrics", multiprocess_dir=None, buckets=DEFAULT_BUCKETS, flush_interval=5):
+        """:path route to serve the metrics on :multiprocess_dir directory
+        the workers share their metrics through :buckets latency histogram
+        bucket upper bounds in seconds :flush_interval minimum seconds
+        between each worker writing its metrics to ``multiprocess_dir``."""
+        self.flask_app = app
+        self.registry = MetricsRegistry(prefix="fsd_http_")
+        self.request_duration = self.registry.histogram(
+            "request_duration_seconds", "Time taken to handle requests by endpoint", buckets=buckets
+        )
+        self.requests = self.registry.counter("requests_total", "Requests handled by endpoint and status")
+
+        multiprocess_dir = multiprocess_dir or app.config.get("FSD_METRICS_MULTIPROCESS_DIR")
+        self.collector = None
+        if multiprocess_dir:
+            self.collector = MultiProcessCollector(self.registry, multiprocess_dir, flush_interval=flush_interval)
+            atexit.register(self.collector.flush)
+
+        self.flask_app.add_url_rule(path, view_func=self.metrics_view, host="<host>")
+        self.flask_app.before_request(self._before_request)
+        self.flask_app.after_request(self._after_request)
+        self.flask_app.extensions["fsd_endpoint_metrics"] = self
+
+    def _before_request(self):
+        if not hasattr(request, "before_request_real_time"):
+            request.before_request_real_time = time.perf_counter()
+
+    def _after_request(self, response):
+        start = getattr(request, "before_request_real_time", None)
+        if request.endpoint == self.metrics_view.__name__ or start is None:
+            return response
+        # Unmatched urls share one label so 404s for arbitrary paths can't create unlimited label sets
+        endpoint = request.endpoint or "unmatched"
+        self.request_duration.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+        self.requests.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+        if self.collector is not None:
+            self.collector.maybe_flush()
+        return response
+
+    def metrics_view(self, host=None):
+        if self.collector is not None:
+            text = self.collector.generate_latest()
+        else:
+            text = self.registry.generate_latest()
+        return Response(text, mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,116 @@
+import glob
+import json
+import os
+import threading
+import time
+
+from fsd_utils.metrics.registry import render_text
+
+
+class MultiProcessCollector:
+    """Aggregates a registry across processes, eg. gunicorn workers, which
+    each have their own copy of it. Every process periodically writes a
+    snapshot of its registry to ``<path>/metrics-<pid>.json``, and collecting
+    merges the snapshots of all processes: counter, gauge and histogram
+    values are summed per label set.
+
+    Snapshots of workers that have exited are kept so counters don't go
+    backwards, so ``path`` should be emptied when the server starts."""
+
+    def __init__(self, registry, path, flush_interval=5):
+        """:registry MetricsRegistry with this process's metrics :path
+        directory shared by all the processes :flush_interval minimum
+        number of seconds between writes of this process's snapshot."""
+        self.registry = registry
+        self.path = path
+        self.flush_interval = flush_interval
+        self._last_flush = None
+        self._lock = threading.Lock()
+
+    @property
+    def snapshot_path(self):
+        # Looked up on each write so a worker forked after this was created writes its own file
+        return os.path.join(self.path, f"metrics-{os.getpid()}.json")
+
+    def maybe_flush(self):
+        """Write this process's snapshot if ``flush_interval`` has passed since the last write."""
+        last_flush = self._last_flush
+        if last_flush is None or time.monotonic() - last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's snapshot, replacing the previous one atomically."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            snapshot = {
+                name: {
+                    "type": metric["type"],
+                    "documentation": metric["documentation"],
+                    "values": [[list(label_key), _dump_value(value)] for label_key, value in metric["values"].items()],
+                }
+                for name, metric in self.registry.snapshot().items()
+            }
+            snapshot_path = self.snapshot_path
+            os.makedirs(self.path, exist_ok=True)
+            temporary_path = f"{snapshot_path}.tmp"
+            with open(temporary_path, "w") as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.replace(temporary_path, snapshot_path)
+
+    def snapshot(self):
+        """Flush this process's snapshot and return the merged snapshot of all processes."""
+        self.flush()
+        merged = {}
+        for snapshot_path in sorted(glob.glob(os.path.join(self.path, "metrics-*.json"))):
+            try:
+                with open(snapshot_path) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError):
+                # Removed or being replaced by its worker
+                continue
+            for name, metric in snapshot.items():
+                merged_metric = merged.setdefault(
+                    name, {"type": metric["type"], "documentation": metric["documentation"], "values": {}}
+                )
+                values = merged_metric["values"]
+                for label_key, value in metric["values"]:
+                    label_key = tuple(tuple(pair) for pair in label_key)
+                    value = _load_value(value)
+                    values[label_key] = _merge_values(values[label_key], value) if label_key in values else value
+        return merged
+
+    def generate_latest(self):
+        """Render the metrics of all processes in the Prometheus text exposition format."""
+        return render_text(self.snapshot())
+
+
+def clear_snapshots(path):
+    """Remove the snapshots left by previous processes, eg. from gunicorn's
+    ``on_starting`` hook."""
+    for snapshot_path in glob.glob(os.path.join(path, "metrics-*.json*")):
+        try:
+            os.remove(snapshot_path)
+        except FileNotFoundError:
+            pass
+
+
+def _dump_value(value):
+    if isinstance(value, dict):
+        # Histogram, JSON object keys can't be floats
+        return {"buckets": list(value["buckets"].items()), "sum": value["sum"], "count": value["count"]}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict):
+        return {"buckets": dict(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+    return value
+
+
+def _merge_values(value, other):
+    if isinstance(value, dict):
+        buckets = dict(value["buckets"])
+        for upper_bound, count in other["buckets"].items():
+            buckets[upper_bound] = buckets.get(upper_bound, 0) + count
+        return {"buckets": buckets, "sum": value["sum"] + other["sum"], "count": value["count"] + other["count"]}
+    return value + other
@@ -0,0 +1,193 @@
+import threading
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    """A monotonically increasing value, optionally split by labels."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def collect(self):
+        with self._lock:
+            return {key: value for key, value in self._values.items()}
+
+    def samples(self):
+        return _samples(self.type, self.name, self.collect())
+
+
+class Gauge(Counter):
+    """A value that can go up and down, or is read from a callback when
+    collected."""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, function=None):
+        super().__init__(name, documentation)
+        self._function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        if self._function is not None and not labels:
+            return self._function()
+        return super().value(**labels)
+
+    def collect(self):
+        values = super().collect()
+        if self._function is not None:
+            values[()] = self._function()
+        return values
+
+
+class Histogram:
+    """Counts observations into cumulative buckets and keeps their sum, the
+    same model Prometheus uses so percentiles can be estimated from it."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        """Return ``{label_key: {"buckets": {le: cumulative count}, "sum": s, "count": n}}``."""
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        collected = {}
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            buckets = {}
+            for upper_bound, count in zip(self.buckets, counts, strict=True):
+                cumulative += count
+                buckets[upper_bound] = cumulative
+            collected[key] = {"buckets": buckets, "sum": total, "count": cumulative}
+        return collected
+
+    def value(self, **labels):
+        return self.collect().get(_label_key(labels), {"buckets": {}, "sum": 0, "count": 0})
+
+    def samples(self):
+        return _samples(self.type, self.name, self.collect())
+
+
+def _samples(metric_type, name, collected):
+    for key, value in collected.items():
+        if metric_type == "histogram":
+            for upper_bound, count in value["buckets"].items():
+                yield f"{name}_bucket", key, (("le", _format_value(upper_bound)),), count
+            yield f"{name}_sum", key, (), value["sum"]
+            yield f"{name}_count", key, (), value["count"]
+        else:
+            yield name, key, (), value
+
+
+def render_text(snapshot):
+    """Render a ``MetricsRegistry.snapshot()`` in the Prometheus text exposition format."""
+    lines = []
+    for name, metric in snapshot.items():
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for sample_name, label_key, extra, value in _samples(metric["type"], name, metric["values"]):
+            lines.append(f"{sample_name}{_format_labels(label_key, extra)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRegistry:
+    """A collection of named metrics that can be read in process or rendered
+    in the Prometheus text exposition format."""
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation):
+        return self._register(Counter(self.prefix + name, documentation))
+
+    def gauge(self, name, documentation, function=None):
+        return self._register(Gauge(self.prefix + name, documentation, function=function))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self.prefix + name, documentation, buckets=buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics[self.prefix + name]
+
+    def collect(self):
+        """Return a snapshot of every metric keyed by name."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.collect() for metric in metrics}
+
+    def snapshot(self):
+        """Return ``{name: {"type": t, "documentation": d, "values": collected}}`` for every metric."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {"type": metric.type, "documentation": metric.documentation, "values": metric.collect()}
+            for metric in metrics
+        }
+
+    def generate_latest(self):
+        """Render every metric in the Prometheus text exposition format."""
+        return render_text(self.snapshot())
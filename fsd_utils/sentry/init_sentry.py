@@ -2,8 +2,10 @@ from os import getenv
 
 import sentry_sdk
 from sentry_sdk.integrations.flask import FlaskIntegration
+from sentry_sdk.scope import add_global_event_processor
 
 from fsd_utils import CommonConfig
+from fsd_utils.authentication.models import _add_user_to_sentry_event
 
 
 def _traces_sampler(sampling_context):
@@ -30,6 +32,7 @@ def init_sentry():
             profiles_sampler=_traces_sampler,
             release=getenv("GITHUB_SHA"),
         )
+        add_global_event_processor(_add_user_to_sentry_event)
 
 
 def clear_sentry():
@@ -1,4 +1,5 @@
 import json
+import time
 from datetime import datetime
 
 import boto3
@@ -27,12 +28,14 @@ class SQSExtendedClient:
         always_through_s3=None,
         delete_payload_from_s3=None,
         logger=None,
+        s3_fetch_histogram=None,
         **kwargs,
     ):
         self.large_payload_support = large_payload_support
         self.always_through_s3 = always_through_s3
         self.delete_payload_from_s3 = delete_payload_from_s3
         self.logger = logger
+        self.s3_fetch_histogram = s3_fetch_histogram
 
         if aws_access_key_id and aws_secret_access_key:
             self.sqs_client = boto3.client(
@@ -114,7 +117,7 @@ class SQSExtendedClient:
         self.logger.info("Called SQS and submitted the message and id [%s]", message_id)
         return message_id
 
-    def receive_messages(self, queue_url, max_number, visibility_time=1, wait_time=1):
+    def receive_messages(self, queue_url, max_number, visibility_time=1, wait_time=1, retrieve_payloads=True):
         """
         Receive a batch of messages in a single request from an SQS queue.
         :param queue_url: SQS Queue url
@@ -127,12 +130,14 @@ class SQSExtendedClient:
         :param wait_time: The maximum time to wait (in seconds) before returning. When
                         this number is greater than zero, long polling is used. This
                         can result in reduced costs and fewer false empty responses.
+        :param retrieve_payloads: Whether to fetch the S3 payloads straight away, when False the "s3" value of each
+                                  message is None until it is fetched with `retrieve_payload`.
         :return: The list of Message objects received. These each contain the body
                 of the message and metadata and custom attributes.
         """
         response = self.sqs_client.receive_message(
             QueueUrl=queue_url,
-            AttributeNames=["SentTimestamp", "ApproximateReceiveCount"],
+            AttributeNames=["SentTimestamp", "ApproximateReceiveCount", "MessageDeduplicationId", "MessageGroupId"],
             MessageAttributeNames=["All"],
             MaxNumberOfMessages=max_number,
             VisibilityTimeout=visibility_time,
@@ -155,19 +160,84 @@ class SQSExtendedClient:
             for msg in messages:
                 dict_msg = {
                     "sqs": msg,
-                    "s3": self._retrieve_message_from_s3(msg["Body"]),
+                    "s3": self._retrieve_message_from_s3(msg["Body"]) if retrieve_payloads else None,
                 }
                 extended_message.append(dict_msg)
             return extended_message
         return messages
 
-    def delete_messages(self, queue_url, messages):
+    def retrieve_payload(self, message):
+        """
+        Fetch the S3 payload of a message received with `retrieve_payloads=False`, e.g. after checking that it isn't
+        a redelivery whose payload was already deleted.
+        :param message: A message returned by `receive_messages`
+        :return: The message with its "s3" payload filled in.
+        """
+        if message["s3"] is None:
+            message["s3"] = self._retrieve_message_from_s3(message["sqs"]["Body"])
+        return message
+
+    def delete_messages(self, queue_url, messages, delete_payload=True):
         validate_messages(messages)
         reciept_handles_to_delete = []
-        if self.large_payload_support and self.always_through_s3:
+        if delete_payload and self.large_payload_support and self.always_through_s3:
             return self._delete_msg_from_sqs_and_s3(messages, queue_url, reciept_handles_to_delete)
         return self._delete_msg_from_sqs(messages, queue_url, reciept_handles_to_delete)
 
+    def forward_message(self, queue_url, message):
+        """
+        Send a received message to another queue (e.g. a dead letter queue) unchanged, the message body still
+        points at the same S3 payload so the original must be deleted with `delete_payload=False`.
+        :param queue_url: SQS Queue url to forward the message to
+        :param message: The received SQS message
+        :return: The id of the forwarded message
+        """
+        message_attributes = {
+            key: {
+                name: value for name, value in attribute.items() if name in ("DataType", "StringValue", "BinaryValue")
+            }
+            for key, attribute in message.get("MessageAttributes", {}).items()
+        }
+        send_kwargs = {}
+        attributes = message.get("Attributes", {})
+        if "MessageGroupId" in attributes:
+            send_kwargs["MessageGroupId"] = attributes["MessageGroupId"]
+            send_kwargs["MessageDeduplicationId"] = message["MessageId"]
+        response = self.sqs_client.send_message(
+            QueueUrl=queue_url,
+            MessageBody=message["Body"],
+            MessageAttributes=message_attributes,
+            **send_kwargs,
+        )
+        status_code = response["ResponseMetadata"]["HTTPStatusCode"]
+        if status_code != 200:
+            raise SQSExtendedClientException(ExceptionMessages.FAILED_SUBMIT_MESSAGE.format(status_code))
+        self.logger.info("Forwarded message [%s] as [%s]", message["MessageId"], response["MessageId"])
+        return response["MessageId"]
+
+    def change_messages_visibility(self, queue_url, messages, visibility_time):
+        """
+        Change the visibility timeout of a batch of received messages, a visibility timeout of 0 makes the
+        messages available to other receivers straight away. The S3 payloads are kept.
+        :param queue_url: SQS Queue url
+        :param messages: The received SQS messages
+        :param visibility_time: The new visibility timeout in seconds
+        :return: The response from SQS that contains the list of successful and failed changes.
+        """
+        validate_messages(messages)
+        entries = [
+            {"Id": str(ind), "ReceiptHandle": message["ReceiptHandle"], "VisibilityTimeout": visibility_time}
+            for ind, message in enumerate(messages)
+        ]
+        response = self.sqs_client.change_message_visibility_batch(QueueUrl=queue_url, Entries=entries)
+        status_code = response["ResponseMetadata"]["HTTPStatusCode"]
+        if status_code != 200:
+            raise SQSExtendedClientException(ExceptionMessages.FAILED_CHANGE_MESSAGE_VISIBILITY.format(status_code))
+        if "Failed" in response:
+            for msg_meta in response["Failed"]:
+                self.logger.info("Could not change visibility of %s", messages[int(msg_meta["Id"])]["MessageId"])
+        return response
+
     def _delete_msg_from_sqs_and_s3(self, messages, queue_url, reciept_handles_to_delete):
         self._delete_message_from_s3(messages, reciept_handles_to_delete)
         entries = [
@@ -237,6 +307,7 @@ class SQSExtendedClient:
             raise SQSExtendedClientException(ExceptionMessages.INVALID_FORMAT_WHEN_RETRIEVING_STORED_S3_MESSAGES)
         s3_details = message_body[1]
         s3_bucket_name, s3_key = s3_details["s3BucketName"], s3_details["s3Key"]
+        start = time.perf_counter()
         response = self.s3_client.get_object(Bucket=s3_bucket_name, Key=s3_key)
         # The message body is under a wrapper class called StreamingBody
         status_code = response["ResponseMetadata"]["HTTPStatusCode"]
@@ -245,6 +316,8 @@ class SQSExtendedClient:
         self.logger.info("Called S3 and received the message")
         streaming_body = response["Body"]
         message_body = streaming_body.read().decode()
+        if self.s3_fetch_histogram is not None:
+            self.s3_fetch_histogram.observe(time.perf_counter() - start)
         return message_body
 
     def _store_message_in_s3(self, message_body: str, message_attributes: dict, extra_attributes: dict) -> (str, dict):
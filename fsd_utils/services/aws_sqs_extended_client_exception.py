@@ -29,3 +29,4 @@ class ExceptionMessages:
     FAILED_DELETE_MESSAGE = "delete_object failed with status code {0}"
     FAILED_SUBMIT_MESSAGE = "submit_single_message failed with status code {0}"
     FAILED_RECEIVE_MESSAGE = "receive_messages failed with status code {0}"
+    FAILED_CHANGE_MESSAGE_VISIBILITY = "change_messages_visibility failed with status code {0}"
@@ -18,6 +18,11 @@ class ContextAwareExecutor:
         """Get queue size of the Thread pool."""
         return self.executor._work_queue.qsize()
 
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Shut down the thread pool :wait block until running tasks finish
+        :cancel_futures cancel tasks that have not started yet."""
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
     def submit(self, fn, *args, **kwargs):
         """Submit executor to the thread pool."""
         ctx = copy_context()
@@ -0,0 +1,8 @@
+class TransientMessageError(Exception):
+    """Raised by a message executor when processing failed for a reason that
+    is likely to go away, the message is retried in process with backoff."""
+
+
+class PoisonMessageError(Exception):
+    """Raised by a message executor when the message can never be processed,
+    the message is forwarded straight to the dead letter queue."""
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+IN_FLIGHT = "in_flight"
+COMPLETED = "completed"
+
+
+class MessageIdempotencyCache:
+    """Bounded TTL cache of SQS message keys that are being processed or were
+    processed recently.
+
+    Standard SQS queues deliver at least once, so the same message can be
+    received again while the original delivery is still running. Each message
+    is identified by its ``MessageId`` and, when present, its
+    ``MessageDeduplicationId``; a message is only claimed if none of its keys
+    are already known.
+    """
+
+    def __init__(self, max_size=10000, ttl=300, clock=time.monotonic):
+        """Initialise the cache :max_size maximum number of keys to hold, the
+        oldest keys are evicted first :ttl number of seconds a key is
+        remembered for :clock monotonic clock used to expire keys."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            self._expire(self._clock())
+            return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire(self._clock())
+            return key in self._entries
+
+    def claim(self, keys):
+        """Mark the given keys as in flight unless the message is already known.
+
+        :param keys: Keys identifying a single message.
+        :return: None if the keys were claimed, otherwise the state of the
+                 message, COMPLETED if any of its keys completed recently or
+                 IN_FLIGHT if it is still being processed.
+        """
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            states = {self._entries[key][0] for key in keys if key in self._entries}
+            if states:
+                return COMPLETED if COMPLETED in states else IN_FLIGHT
+            for key in keys:
+                self._set(key, IN_FLIGHT, now)
+            return None
+
+    def complete(self, keys):
+        """Mark the given keys as completed so redeliveries within the TTL are
+        treated as duplicates."""
+        with self._lock:
+            now = self._clock()
+            for key in keys:
+                self._set(key, COMPLETED, now)
+
+    def release(self, keys):
+        """Forget the given keys so the message can be processed again, e.g.
+        after it failed."""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def _set(self, key, state, now):
+        self._entries[key] = (state, now + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _expire(self, now):
+        # Entries are kept in insertion order and share one TTL, so expired
+        # entries are always at the front.
+        while self._entries:
+            key, (_, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            del self._entries[key]
+
+
+def get_message_keys(sqs_message):
+    """Return the idempotency keys of a raw SQS message."""
+    keys = [("MessageId", sqs_message["MessageId"])]
+    deduplication_id = sqs_message.get("Attributes", {}).get("MessageDeduplicationId")
+    if deduplication_id:
+        keys.append(("MessageDeduplicationId", deduplication_id))
+    return keys
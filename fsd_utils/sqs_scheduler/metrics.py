@@ -0,0 +1,40 @@
+from fsd_utils.metrics.registry import MetricsRegistry
+
+
+class TaskExecutorMetrics:
+    """Counters and histograms describing the throughput of a
+    TaskExecutorService, so it is possible to tell whether the workers are
+    limited by SQS, S3 or the executor."""
+
+    def __init__(self, registry=None, queue_depth=None, in_flight=None):
+        """Register the metrics :registry MetricsRegistry to register into, a
+        new one prefixed with ``fsd_sqs_`` is created if not given
+        :queue_depth callable returning the executor queue depth :in_flight
+        callable returning the number of messages being processed."""
+        self.registry = registry or MetricsRegistry(prefix="fsd_sqs_")
+        self.received = self.registry.counter("messages_received_total", "Messages received from SQS")
+        self.processed = self.registry.counter("messages_processed_total", "Messages processed successfully")
+        self.failed = self.registry.counter("messages_failed_total", "Messages that failed processing")
+        self.deleted = self.registry.counter("messages_deleted_total", "Messages deleted from SQS")
+        self.duplicates = self.registry.counter("messages_duplicate_total", "Duplicate deliveries skipped")
+        self.retried = self.registry.counter("messages_retried_total", "In process retries of failed messages")
+        self.dead_lettered = self.registry.counter(
+            "messages_dead_lettered_total", "Poison messages moved to the dead letter queue"
+        )
+        self.receive_to_complete = self.registry.histogram(
+            "message_receive_to_complete_seconds", "Time from receiving a message to finishing processing it"
+        )
+        self.receive_time = self.registry.histogram("receive_seconds", "Time spent in SQS receive calls")
+        self.s3_fetch_time = self.registry.histogram("s3_fetch_seconds", "Time spent fetching payloads from S3")
+        self.queue_depth = self.registry.gauge(
+            "executor_queue_depth", "Tasks waiting for an executor thread", function=queue_depth
+        )
+        self.in_flight = self.registry.gauge("messages_in_flight", "Messages being processed", function=in_flight)
+
+    def snapshot(self):
+        """Return the current value of every metric keyed by name."""
+        return self.registry.collect()
+
+    def generate_latest(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        return self.registry.generate_latest()
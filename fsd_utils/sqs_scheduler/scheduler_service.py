@@ -1,5 +1,123 @@
+import os
+import random
+import tempfile
+import threading
+from contextlib import contextmanager
+
 from fsd_utils.sqs_scheduler.task_executer_service import TaskExecutorService
 
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where HostLease can't be used
+    fcntl = None
+
+
+class HostLease:
+    """Limits the number of processes on a host that hold the lease at the same
+    time, e.g. so only N gunicorn workers poll SQS concurrently. Each slot is an
+    exclusive ``flock`` on a file in ``lock_dir`` which the OS releases if the
+    process dies."""
+
+    def __init__(self, name, slots=1, lock_dir=None):
+        """:name lease name, shared by every process competing for it :slots
+        number of processes that can hold the lease at once :lock_dir
+        directory for the lock files, defaults to the temp directory."""
+        if fcntl is None:
+            raise NotImplementedError("HostLease needs fcntl, which is not available on this platform")
+        self.slots = slots
+        lock_dir = lock_dir or tempfile.gettempdir()
+        self.paths = [os.path.join(lock_dir, f"fsd-lease-{name}-{slot}.lock") for slot in range(slots)]
+
+    @contextmanager
+    def hold(self):
+        """Try to take a free slot without blocking, yields True if one was
+        taken and releases it on exit."""
+        fd = None
+        for path in self.paths:
+            candidate = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(candidate, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(candidate)
+                continue
+            fd = candidate
+            break
+        try:
+            yield fd is not None
+        finally:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+
+class ProcessMessagesTrigger:
+    """Calls ``process_messages`` from a scheduler without letting runs stack
+    up. A tick that arrives while the previous run is still going is skipped,
+    or with ``coalesce`` folded into a single follow-up run."""
+
+    def __init__(self, task_executor_service: TaskExecutorService, coalesce=False, jitter=0, host_lease=None):
+        """:task_executor_service service whose messages are processed
+        :coalesce run once more after the current run instead of dropping
+        overlapping ticks :jitter maximum random delay in seconds before
+        polling, spreads the workers started at the same time :host_lease
+        optional HostLease that must be held to poll."""
+        self.task_executor_service = task_executor_service
+        self.coalesce = coalesce
+        self.jitter = jitter
+        self.host_lease = host_lease
+        self.logger = task_executor_service.logger
+        self._lock = threading.Lock()
+        self._pending = False
+
+    def __call__(self):
+        """Run ``process_messages`` unless a run is already in progress.
+
+        :return: True if this call processed messages.
+        """
+        ran = False
+        while True:
+            if not self._lock.acquire(blocking=False):
+                if not self.coalesce:
+                    self.logger.debug("Previous message processing still running hence skipping this tick")
+                    return ran
+                self._pending = True
+                # The running call will pick up the pending tick unless it finished in the meantime
+                if not self._lock.acquire(blocking=False):
+                    return ran
+            try:
+                self._pending = False
+                ran = self._run() or ran
+            finally:
+                self._lock.release()
+            if not self._pending:
+                return ran
+
+    def _run(self):
+        if self.jitter:
+            # Waiting on the drain event lets a shutdown interrupt the delay
+            if self.task_executor_service.draining.wait(random.uniform(0, self.jitter)):
+                return False
+        if self.host_lease is None:
+            self.task_executor_service.process_messages()
+            return True
+        with self.host_lease.hold() as acquired:
+            if not acquired:
+                self.logger.debug("All host lease slots are taken hence skipping this tick")
+                return False
+            self.task_executor_service.process_messages()
+            return True
+
+
+_default_trigger_lock = threading.Lock()
+
 
 def scheduler_executor(task_executor_service: TaskExecutorService):
-    task_executor_service.process_messages()
+    """Scheduler job that processes messages, ticks that overlap a previous
+    run of the same service are skipped."""
+    with _default_trigger_lock:
+        # Kept on the service so the trigger goes away with it
+        trigger = getattr(task_executor_service, "_process_messages_trigger", None)
+        if trigger is None:
+            trigger = task_executor_service._process_messages_trigger = ProcessMessagesTrigger(task_executor_service)
+    return trigger()
@@ -1,8 +1,18 @@
+import os
+import random
+import signal
 import threading
+import time
 from abc import abstractmethod
-from concurrent.futures import as_completed
+from concurrent.futures import as_completed, wait
 
 from fsd_utils.services.aws_extended_client import SQSExtendedClient
+from fsd_utils.sqs_scheduler.exceptions import PoisonMessageError, TransientMessageError
+from fsd_utils.sqs_scheduler.idempotency_cache import COMPLETED, MessageIdempotencyCache, get_message_keys
+from fsd_utils.sqs_scheduler.metrics import TaskExecutorMetrics
+
+# Most entries SQS accepts in a single batch request
+SQS_MAX_BATCH_SIZE = 10
 
 
 class TaskExecutorService:
@@ -20,6 +30,14 @@ class TaskExecutorService:
         aws_access_key_id=None,
         aws_secret_access_key=None,
         region_name=None,
+        dedup_cache_max_size=10000,
+        dedup_cache_ttl=300,
+        max_retries=0,
+        retry_backoff=1,
+        retry_backoff_max=30,
+        transient_exceptions=(TransientMessageError,),
+        sqs_dlq_url=None,
+        metrics_registry=None,
     ):
         self.executor = executor
         self.sqs_primary_url = sqs_primary_url
@@ -27,7 +45,23 @@ class TaskExecutorService:
         self.sqs_batch_size = sqs_batch_size
         self.visibility_time = visibility_time
         self.sqs_wait_time = sqs_wait_time
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.transient_exceptions = transient_exceptions
+        self.sqs_dlq_url = sqs_dlq_url
         self.logger = flask_app.logger
+        self.message_cache = MessageIdempotencyCache(max_size=dedup_cache_max_size, ttl=dedup_cache_ttl)
+        self.draining = threading.Event()
+        self._in_flight = {}
+        # Completed messages waiting to be deleted, shared with drain so none are left behind on shutdown
+        self._pending_deletes = []
+        self._in_flight_lock = threading.Lock()
+        self.metrics = TaskExecutorMetrics(
+            registry=metrics_registry,
+            queue_depth=self.executor.queue_size,
+            in_flight=lambda: len(self._in_flight),
+        )
         self.sqs_extended_client = SQSExtendedClient(
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
@@ -37,6 +71,7 @@ class TaskExecutorService:
             always_through_s3=True,
             delete_payload_from_s3=True,
             logger=self.logger,
+            s3_fetch_histogram=self.metrics.s3_fetch_time,
         )
         self.logger.info("Created the thread pool executor to process messages in extended SQS queue")
 
@@ -48,6 +83,9 @@ class TaskExecutorService:
         current_thread = threading.current_thread()
         thread_id = f"[{current_thread.name}:{current_thread.ident}]"
         self.logger.debug("%s Triggered schedular to get messages", thread_id)
+        if self.draining.is_set():
+            self.logger.debug("%s Service is draining hence not reading messages from queue", thread_id)
+            return
 
         running_threads, read_msg_ids = self._handle_message_receiving_and_processing()
 
@@ -55,6 +93,68 @@ class TaskExecutorService:
 
         self.logger.debug("%s Message Processing completed and will start again later", thread_id)
 
+    def drain(self, timeout):
+        """
+        Stop reading messages from the queue and wait up to the given deadline for the running tasks, completed
+        messages are deleted and the visibility of unfinished messages is reset so other consumers pick them up
+        straight away instead of waiting for the visibility timeout
+        :param timeout Maximum number of seconds to wait for the running tasks
+        :return: Tuple of the number of deleted and released messages
+        """
+        self.draining.set()
+        with self._in_flight_lock:
+            futures = list(self._in_flight)
+        self.logger.info("Draining the task executor with [%s] messages in flight", len(futures))
+        wait(futures, timeout=timeout)
+
+        messages_to_release = []
+        with self._in_flight_lock:
+            in_flight = self._in_flight
+            self._in_flight = {}
+            messages_to_delete = self._pending_deletes
+            self._pending_deletes = []
+        for future, sqs_message in in_flight.items():
+            if not future.done():
+                future.cancel()
+                messages_to_release.append(sqs_message)
+            elif not future.cancelled() and future.exception() is None:
+                messages_to_delete.append(sqs_message)
+
+        # More messages than fit in one SQS batch request can be in flight
+        for start in range(0, len(messages_to_delete), SQS_MAX_BATCH_SIZE):
+            self._delete_messages(messages_to_delete[start : start + SQS_MAX_BATCH_SIZE])
+        for start in range(0, len(messages_to_release), SQS_MAX_BATCH_SIZE):
+            self.sqs_extended_client.change_messages_visibility(
+                self.sqs_primary_url, messages_to_release[start : start + SQS_MAX_BATCH_SIZE], 0
+            )
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.logger.info(
+            "Drained the task executor, deleted [%s] and released [%s] messages",
+            len(messages_to_delete),
+            len(messages_to_release),
+        )
+        return len(messages_to_delete), len(messages_to_release)
+
+    def register_drain_signal_handler(self, timeout, signals=(signal.SIGTERM,)):
+        """
+        Drain the service when the process receives one of the given signals, any previously installed handler
+        (e.g. gunicorn's worker exit handler) is called afterwards. Must be called from the main thread.
+        :param timeout Maximum number of seconds to wait for the running tasks
+        :param signals Signals that trigger the drain
+        """
+        for signum in signals:
+            previous_handler = signal.getsignal(signum)
+
+            def handler(received_signum, frame, previous_handler=previous_handler):
+                self.drain(timeout)
+                if callable(previous_handler):
+                    previous_handler(received_signum, frame)
+                elif previous_handler == signal.SIG_DFL:
+                    signal.signal(received_signum, signal.SIG_DFL)
+                    os.kill(os.getpid(), received_signum)
+
+            signal.signal(signum, handler)
+
     @abstractmethod
     def message_executor(self, message):
         """
@@ -64,6 +164,89 @@ class TaskExecutorService:
         """
         pass
 
+    def is_transient_error(self, error):
+        """
+        Whether a failed message should be retried in process, override this for custom classification
+        :param error The exception raised by the message executor
+        """
+        return isinstance(error, self.transient_exceptions)
+
+    def is_poison_error(self, error):
+        """
+        Whether a failed message can never be processed and should go straight to the dead letter queue,
+        override this for custom classification
+        :param error The exception raised by the message executor
+        """
+        return isinstance(error, PoisonMessageError)
+
+    def _delete_messages(self, sqs_messages, **kwargs):
+        self.sqs_extended_client.delete_messages(self.sqs_primary_url, sqs_messages, **kwargs)
+        self.metrics.deleted.inc(len(sqs_messages))
+
+    def _execute_message(self, message, received_at=None):
+        """
+        Run the message executor, retrying transient errors with exponential backoff and forwarding poison
+        messages to the dead letter queue, and record the outcome in the idempotency cache. Failed messages are
+        released so that a redelivery is processed again
+        :param message Json message
+        :param received_at time.monotonic() value when the message was received
+        """
+        keys = get_message_keys(message["sqs"])
+        try:
+            result = self._execute_message_with_retries(message)
+        except Exception as e:
+            self.message_cache.release(keys)
+            self.metrics.failed.inc()
+            if self.sqs_dlq_url and self.is_poison_error(e):
+                self._send_to_dlq(message)
+            raise
+        self.message_cache.complete(keys)
+        self.metrics.processed.inc()
+        if received_at is not None:
+            self.metrics.receive_to_complete.observe(time.monotonic() - received_at)
+        return result
+
+    def _execute_message_with_retries(self, message):
+        attempt = 0
+        while True:
+            try:
+                return self.message_executor(message)
+            except Exception as e:
+                if attempt >= self.max_retries or self.draining.is_set() or not self.is_transient_error(e):
+                    raise
+                attempt += 1
+                self.metrics.retried.inc()
+                delay = random.uniform(0, min(self.retry_backoff_max, self.retry_backoff * 2 ** (attempt - 1)))
+                self.logger.warning(
+                    "Retrying message [%s] in [%.2f] seconds, attempt [%s] of [%s]: %s",
+                    message["sqs"]["MessageId"],
+                    delay,
+                    attempt,
+                    self.max_retries,
+                    str(e),
+                )
+                # Keep the message hidden from other consumers while we back off
+                self.sqs_extended_client.change_messages_visibility(
+                    self.sqs_primary_url, [message["sqs"]], self.visibility_time + int(delay) + 1
+                )
+                # Waiting on the drain event lets a shutdown interrupt the backoff
+                self.draining.wait(delay)
+
+    def _send_to_dlq(self, message):
+        """
+        Forward a poison message to the dead letter queue and remove it from the primary queue, the S3 payload is
+        kept because the dead letter message still points at it
+        :param message Json message
+        """
+        message_id = message["sqs"]["MessageId"]
+        try:
+            self.sqs_extended_client.forward_message(self.sqs_dlq_url, message["sqs"])
+            self._delete_messages([message["sqs"]], delete_payload=False)
+            self.metrics.dead_lettered.inc()
+            self.logger.warning("Poison message [%s] moved to the dead letter queue", message_id)
+        except Exception as e:
+            self.logger.error("Could not move poison message [%s] to the dead letter queue: %s", message_id, str(e))
+
     def _handle_message_receiving_and_processing(self):
         """
         Handle message retrieve from the SQS service and get the json from S3 bucket
@@ -72,21 +255,60 @@ class TaskExecutorService:
         thread_id = f"[{current_thread.name}:{current_thread.ident}]"
         running_threads = []
         read_msg_ids = []
+        duplicate_messages = []
         if self.task_executor_max_thread >= self.executor.queue_size():
+            start = time.perf_counter()
             sqs_messages = self.sqs_extended_client.receive_messages(
                 self.sqs_primary_url,
                 self.sqs_batch_size,
                 self.visibility_time,
                 self.sqs_wait_time,
+                # Deduplicate before fetching the payloads, a completed message's payload is already deleted
+                retrieve_payloads=False,
             )
-            self.logger.debug("%s Message Count [%s]"), thread_id, {len(sqs_messages)}
+            received_at = time.monotonic()
+            self.metrics.receive_time.observe(time.perf_counter() - start)
+            self.metrics.received.inc(len(sqs_messages))
+            self.logger.debug("%s Message Count [%s]", thread_id, len(sqs_messages))
+            if sqs_messages and self.draining.is_set():
+                # Drain started while long polling, hand the messages straight back to the queue
+                self.sqs_extended_client.change_messages_visibility(
+                    self.sqs_primary_url, [message["sqs"] for message in sqs_messages], 0
+                )
+                sqs_messages = []
             if sqs_messages:
                 for message in sqs_messages:
                     message_id = message["sqs"]["MessageId"]
+                    state = self.message_cache.claim(get_message_keys(message["sqs"]))
+                    if state == COMPLETED:
+                        self.logger.info("%s Duplicate message id [%s] skipped", thread_id, message_id)
+                        duplicate_messages.append(message["sqs"])
+                        self.metrics.duplicates.inc()
+                        continue
+                    if state is not None:
+                        # The original may still fail, so leave the copy on the queue to be redelivered after
+                        # its visibility timeout rather than deleting the only retry the message has left
+                        self.logger.info("%s Duplicate message id [%s] still in flight", thread_id, message_id)
+                        self.metrics.duplicates.inc()
+                        continue
+                    try:
+                        self.sqs_extended_client.retrieve_payload(message)
+                    except Exception as e:
+                        # Left on the queue to be redelivered after its visibility timeout
+                        self.message_cache.release(get_message_keys(message["sqs"]))
+                        self.metrics.failed.inc()
+                        self.logger.error(
+                            "%s Could not retrieve the payload of message id [%s]: %s", thread_id, message_id, str(e)
+                        )
+                        continue
                     self.logger.info("%s Message id [%s]", thread_id, message_id)
                     read_msg_ids.append(message["sqs"]["MessageId"])
-                    task = self.executor.submit(self.message_executor, message)
+                    task = self.executor.submit(self._execute_message, message, received_at)
+                    with self._in_flight_lock:
+                        self._in_flight[task] = message["sqs"]
                     running_threads.append(task)
+            if duplicate_messages:
+                self._delete_messages(duplicate_messages)
         else:
             self.logger.info("%s Max thread limit reached hence stop reading messages from queue", thread_id)
 
@@ -106,18 +328,24 @@ class TaskExecutorService:
         """
         current_thread = threading.current_thread()
         thread_id = f"[{current_thread.name}:{current_thread.ident}]"
-        receipt_handles_to_delete = []
         completed_msg_ids = []
         for future in as_completed(running_threads):
+            with self._in_flight_lock:
+                # A drain may already have taken over this message
+                sqs_message = self._in_flight.pop(future, None)
+                if sqs_message is not None and not future.cancelled() and future.exception() is None:
+                    self._pending_deletes.append(sqs_message)
             try:
                 msg = future.result()
                 msg_id = msg["sqs"]["MessageId"]
-                receipt_handles_to_delete.append(msg["sqs"])
                 completed_msg_ids.append(msg_id)
                 self.logger.debug("%s Execution completed and deleted from queue: %s", thread_id, msg_id)
             except Exception as e:
                 self.logger.error("%s An error occurred while processing the message %s", thread_id, str(e))
         dif_msg_ids = [i for i in read_msg_ids if i not in completed_msg_ids]
         self.logger.debug("No of messages not processed [%s] and msg ids are %s", len(dif_msg_ids), dif_msg_ids)
-        if receipt_handles_to_delete:
-            self.sqs_extended_client.delete_messages(self.sqs_primary_url, receipt_handles_to_delete)
+        with self._in_flight_lock:
+            receipt_handles_to_delete = self._pending_deletes
+            self._pending_deletes = []
+        for start in range(0, len(receipt_handles_to_delete), SQS_MAX_BATCH_SIZE):
+            self._delete_messages(receipt_handles_to_delete[start : start + SQS_MAX_BATCH_SIZE])
@@ -1,6 +1,18 @@
+import asyncio
+import inspect
+import json
+from dataclasses import FrozenInstanceError, asdict
 from pathlib import Path
 
 import jwt as jwt
+import pytest
+from flask import g
+from werkzeug.exceptions import HTTPException
+
+from fsd_utils.authentication.decorators import check_internal_user, login_requested, login_required
+from fsd_utils.authentication.models import Roles, User, _add_user_to_sentry_event
+from fsd_utils.authentication.utils import token_cache
+from fsd_utils.sentry.init_sentry import init_sentry
 
 
 class TestAuthentication:
@@ -299,3 +311,139 @@ class TestAuthentication:
 
         response = flask_test_check_internal_user_client.get("/mock_check_internal_user_route")
         assert response.status_code == 403
+
+    def _run_async_view(self, client, view, token=None):
+        headers = {"Cookie": f"fsd-user-token={token}"} if token else {}
+        with client.application.test_request_context("/", headers=headers):
+            return asyncio.run(view())
+
+    def test_login_required_wraps_coroutine_functions(self, flask_test_client, mocker):
+        @login_required(roles_required=["COF_COMMENTER"])
+        async def view():
+            return g.user.email
+
+        token_cache.clear()
+        to_thread = mocker.spy(asyncio, "to_thread")
+
+        assert inspect.iscoroutinefunction(view)
+        assert self._run_async_view(flask_test_client, view, self._create_valid_token()) == "user@communities.gov.uk"
+        assert to_thread.call_count == 1
+
+    def test_login_required_async_uses_cached_token_without_thread(self, flask_test_client, mocker):
+        @login_required
+        async def view():
+            return g.account_id
+
+        token = self._create_valid_token()
+        assert self._run_async_view(flask_test_client, view, token) == "internal-user"
+        to_thread = mocker.spy(asyncio, "to_thread")
+
+        assert self._run_async_view(flask_test_client, view, token) == "internal-user"
+        to_thread.assert_not_called()
+
+    def test_login_required_async_redirects_with_invalid_token(self, flask_test_client):
+        @login_required
+        async def view():
+            return "unreachable"
+
+        with pytest.raises(HTTPException) as exc_info:
+            self._run_async_view(flask_test_client, view, self._create_invalid_token())
+
+        assert exc_info.value.response.location == "https://authenticator/sessions/sign-out"
+
+    def test_login_requested_async_without_token(self, flask_test_client):
+        @login_requested
+        async def view():
+            return g.is_authenticated, g.account_id
+
+        assert inspect.iscoroutinefunction(view)
+        assert self._run_async_view(flask_test_client, view) == (False, None)
+
+    def test_check_internal_user_async_denies_external_domain(self, flask_test_client):
+        @login_requested
+        @check_internal_user
+        async def view():
+            return "ok"
+
+        assert self._run_async_view(flask_test_client, view, self._create_valid_token(external=False)) == "ok"
+        with pytest.raises(HTTPException) as exc_info:
+            self._run_async_view(flask_test_client, view, self._create_valid_token(external=True))
+        assert exc_info.value.code == 403
+
+
+class TestUser:
+    def test_roles_keep_order_and_support_membership_checks(self):
+        user = User(
+            full_name="Test User",
+            email="test@example.com",
+            roles=["COF_LEAD_ASSESSOR", "COF_COMMENTER"],
+            highest_role_map={"COF": "LEAD_ASSESSOR"},
+        )
+
+        assert user.roles == ["COF_LEAD_ASSESSOR", "COF_COMMENTER"]
+        assert user.has_role("COF_COMMENTER")
+        assert not user.has_role("COF_ASSESSOR")
+        assert user.has_any_role({"COF_ADMIN", "COF_COMMENTER"})
+        assert not user.has_all_roles({"COF_ADMIN", "COF_COMMENTER"})
+        assert asdict(user)["roles"] == ["COF_LEAD_ASSESSOR", "COF_COMMENTER"]
+
+    def test_roles_stay_list_compatible(self):
+        roles = Roles(["COF_COMMENTER"])
+
+        roles.append("COF_ASSESSOR")
+        roles += ["COF_ADMIN"]
+        roles.remove("COF_COMMENTER")
+
+        assert roles == ["COF_ASSESSOR", "COF_ADMIN"]
+        assert "COF_ADMIN" in roles
+        assert "COF_COMMENTER" not in roles
+        assert roles + ["NEW"] == ["COF_ASSESSOR", "COF_ADMIN", "NEW"]
+        assert json.dumps(roles) == '["COF_ASSESSOR", "COF_ADMIN"]'
+        assert not hasattr(roles, "__dict__")
+
+    def test_user_is_immutable(self):
+        user = User(full_name="Test User", email="test@example.com", roles=[], highest_role_map={})
+
+        with pytest.raises(FrozenInstanceError):
+            user.email = "other@example.com"
+
+    def test_set_with_token_does_not_set_sentry_user(self, mocker):
+        set_user = mocker.patch("sentry_sdk.set_user")
+
+        User.set_with_token({"fullName": "Test User", "email": "test@example.com", "roles": []})
+
+        set_user.assert_not_called()
+
+    def test_sentry_event_processor_adds_user_from_g(self, app_context):
+        g.account_id = "test-user"
+        g.user = User(full_name="Test User", email="test@example.com", roles=[], highest_role_map={})
+
+        event = _add_user_to_sentry_event({"user": {"ip_address": "127.0.0.1"}}, {})
+
+        assert event["user"] == {
+            "ip_address": "127.0.0.1",
+            "email": "test@example.com",
+            "id": "test-user",
+            "username": "Test User",
+        }
+
+    def test_sentry_event_processor_without_user(self, app_context):
+        assert _add_user_to_sentry_event({}, {}) == {}
+
+    def test_init_sentry_registers_user_event_processor(self, mocker, monkeypatch):
+        # SENTRY_DSN is read when init_sentry is called, not when fsd_utils is imported
+        monkeypatch.setenv("SENTRY_DSN", "https://key@sentry.example.com/1")
+        mocker.patch("sentry_sdk.init")
+        add_processor = mocker.patch("fsd_utils.sentry.init_sentry.add_global_event_processor")
+
+        init_sentry()
+
+        add_processor.assert_called_once_with(_add_user_to_sentry_event)
+
+    def test_init_sentry_without_dsn_registers_nothing(self, mocker, monkeypatch):
+        monkeypatch.delenv("SENTRY_DSN", raising=False)
+        add_processor = mocker.patch("fsd_utils.sentry.init_sentry.add_global_event_processor")
+
+        init_sentry()
+
+        add_processor.assert_not_called()
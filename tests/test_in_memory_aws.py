@@ -0,0 +1,288 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from fsd_test_utils.fakes.aws import InMemoryS3, InMemorySQS
+from fsd_utils.services.aws_extended_client import SQSExtendedClient
+from fsd_utils.sqs_scheduler.context_aware_executor import ContextAwareExecutor
+from fsd_utils.sqs_scheduler.task_executer_service import TaskExecutorService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def sqs(clock):
+    return InMemorySQS(clock=clock)
+
+
+def test_visibility_timeout_and_receive_count(sqs, clock):
+    queue_url = sqs.create_queue(QueueName="queue")["QueueUrl"]
+    sqs.send_message(QueueUrl=queue_url, MessageBody="body")
+
+    first = sqs.receive_message(QueueUrl=queue_url, AttributeNames=["All"], VisibilityTimeout=10)["Messages"]
+    assert first[0]["Attributes"]["ApproximateReceiveCount"] == "1"
+    assert "Messages" not in sqs.receive_message(QueueUrl=queue_url)
+
+    clock.now = 11
+    second = sqs.receive_message(QueueUrl=queue_url, AttributeNames=["ApproximateReceiveCount"])["Messages"]
+    assert second[0]["Attributes"] == {"ApproximateReceiveCount": "2"}
+
+    # The first receipt handle is stale, deleting with it succeeds but keeps the message
+    stale = sqs.delete_message_batch(
+        QueueUrl=queue_url, Entries=[{"Id": "0", "ReceiptHandle": first[0]["ReceiptHandle"]}]
+    )
+    assert stale["Successful"] == [{"Id": "0"}]
+    response = sqs.delete_message_batch(
+        QueueUrl=queue_url, Entries=[{"Id": "0", "ReceiptHandle": second[0]["ReceiptHandle"]}]
+    )
+    assert response["Successful"] == [{"Id": "0"}]
+    clock.now = 100
+    assert "Messages" not in sqs.receive_message(QueueUrl=queue_url)
+
+
+def test_change_message_visibility_batch(sqs):
+    queue_url = sqs.create_queue(QueueName="queue")["QueueUrl"]
+    sqs.send_message(QueueUrl=queue_url, MessageBody="body")
+    message = sqs.receive_message(QueueUrl=queue_url, VisibilityTimeout=30)["Messages"][0]
+
+    sqs.change_message_visibility_batch(
+        QueueUrl=queue_url, Entries=[{"Id": "0", "ReceiptHandle": message["ReceiptHandle"], "VisibilityTimeout": 0}]
+    )
+
+    assert sqs.receive_message(QueueUrl=queue_url)["Messages"][0]["MessageId"] == message["MessageId"]
+
+
+def test_batch_requests_are_limited_to_10_entries(sqs):
+    queue_url = sqs.create_queue(QueueName="queue")["QueueUrl"]
+    entries = [{"Id": str(index), "MessageBody": "body"} for index in range(11)]
+
+    with pytest.raises(ClientError, match="TooManyEntriesInBatchRequest"):
+        sqs.send_message_batch(QueueUrl=queue_url, Entries=entries)
+    with pytest.raises(ClientError, match="EmptyBatchRequest"):
+        sqs.delete_message_batch(QueueUrl=queue_url, Entries=[])
+    with pytest.raises(ClientError, match="InvalidParameterValue"):
+        sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=11)
+
+    sqs.send_message_batch(QueueUrl=queue_url, Entries=entries[:10])
+    messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)["Messages"]
+    visibility_entries = [
+        {"Id": str(index), "ReceiptHandle": message["ReceiptHandle"], "VisibilityTimeout": 0}
+        for index, message in enumerate(messages * 2)
+    ]
+    with pytest.raises(ClientError, match="TooManyEntriesInBatchRequest"):
+        sqs.change_message_visibility_batch(QueueUrl=queue_url, Entries=visibility_entries)
+
+
+def test_fifo_deduplication_and_message_groups(sqs):
+    queue_url = sqs.create_queue(QueueName="queue.fifo", Attributes={"FifoQueue": "true"})["QueueUrl"]
+    first_id = sqs.send_message(
+        QueueUrl=queue_url, MessageBody="1", MessageGroupId="group", MessageDeduplicationId="dedup"
+    )["MessageId"]
+    duplicate_id = sqs.send_message(
+        QueueUrl=queue_url, MessageBody="1", MessageGroupId="group", MessageDeduplicationId="dedup"
+    )["MessageId"]
+    sqs.send_message(QueueUrl=queue_url, MessageBody="2", MessageGroupId="group", MessageDeduplicationId="other")
+
+    assert first_id == duplicate_id
+    assert len(sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10)["Messages"]) == 1
+
+
+def test_redrive_to_dead_letter_queue(sqs, clock):
+    queue_url = sqs.create_queue(QueueName="queue")["QueueUrl"]
+    dlq_url = sqs.create_queue(QueueName="queue-dlq")["QueueUrl"]
+    dlq_arn = sqs.get_queue_attributes(QueueUrl=dlq_url, AttributeNames=["QueueArn"])["Attributes"]["QueueArn"]
+    sqs.set_queue_attributes(
+        QueueUrl=queue_url,
+        Attributes={"RedrivePolicy": json.dumps({"deadLetterTargetArn": dlq_arn, "maxReceiveCount": 1})},
+    )
+    sqs.send_message(QueueUrl=queue_url, MessageBody="body")
+    sqs.receive_message(QueueUrl=queue_url, VisibilityTimeout=1)
+
+    clock.now = 2
+    assert "Messages" not in sqs.receive_message(QueueUrl=queue_url)
+    assert sqs.receive_message(QueueUrl=dlq_url)["Messages"][0]["Body"] == "body"
+
+
+def test_unknown_queue_and_key_raise_client_errors(sqs):
+    s3 = InMemoryS3()
+    s3.create_bucket(Bucket="bucket")
+
+    with pytest.raises(ClientError):
+        sqs.receive_message(QueueUrl="missing")
+    with pytest.raises(ClientError):
+        s3.get_object(Bucket="bucket", Key="missing")
+
+
+def test_latency_is_injected_per_operation():
+    latency = MagicMock(return_value=0)
+    sqs = InMemorySQS(latency=latency)
+
+    sqs.create_queue(QueueName="queue")
+
+    latency.assert_called_once_with("create_queue")
+
+
+def _create_service(sqs, visibility_time=30):
+    flask_app = MagicMock()
+    service = AnyTaskExecutorService(
+        flask_app=flask_app,
+        executor=ContextAwareExecutor(max_workers=2, thread_name_prefix="NotifTask", flask_app=flask_app),
+        s3_bucket="bucket",
+        sqs_primary_url=None,
+        task_executor_max_thread=5,
+        sqs_batch_size=10,
+        visibility_time=visibility_time,
+        sqs_wait_time=0,
+        aws_access_key_id="test_accesstoken",  # pragma: allowlist secret
+        aws_secret_access_key="secret_key",  # pragma: allowlist secret
+        region_name="eu-west-2",
+    )
+    client: SQSExtendedClient = service.sqs_extended_client
+    client.sqs_client = sqs
+    client.s3_client = InMemoryS3()
+    client.s3_client.create_bucket(Bucket="bucket")
+    service.sqs_primary_url = sqs.create_queue(QueueName="queue")["QueueUrl"]
+    return service
+
+
+def test_task_executor_service_end_to_end():
+    service = _create_service(InMemorySQS())
+    client = service.sqs_extended_client
+    for index in range(3):
+        client.submit_single_message(queue_url=service.sqs_primary_url, message=f"message {index}")
+
+    service.process_messages()
+
+    assert service.metrics.processed.value() == 3
+    assert client.receive_messages(service.sqs_primary_url, 10) == []
+    assert client.s3_client.list_object_keys("bucket") == []
+
+
+def test_redelivery_of_an_in_flight_message_is_retried_if_the_original_fails(sqs, clock):
+    service = _create_service(sqs, visibility_time=1)
+    client = service.sqs_extended_client
+    client.submit_single_message(queue_url=service.sqs_primary_url, message="message")
+    blocked = threading.Event()
+    calls = []
+
+    def message_executor(message):
+        calls.append(message["sqs"]["MessageId"])
+        if len(calls) == 1:
+            blocked.wait(5)
+            raise Exception("failed")
+        return message
+
+    service.message_executor = message_executor
+    running_threads, read_msg_ids = service._handle_message_receiving_and_processing()
+
+    # Redelivered after the visibility timeout while the first run is still going
+    clock.now = 2
+    assert service._handle_message_receiving_and_processing() == ([], [])
+    blocked.set()
+    service._handle_message_delete_processing(running_threads, read_msg_ids)
+
+    clock.now = 4
+    service.process_messages()
+
+    assert len(calls) == 2
+    assert service.metrics.failed.value() == 1
+    assert service.metrics.processed.value() == 1
+    clock.now = 10
+    assert client.receive_messages(service.sqs_primary_url, 10) == []
+
+
+def test_redelivery_of_a_completed_message_is_deleted(sqs, clock):
+    service = _create_service(sqs, visibility_time=1)
+    client = service.sqs_extended_client
+    client.submit_single_message(queue_url=service.sqs_primary_url, message="message")
+    blocked = threading.Event()
+    calls = []
+
+    def message_executor(message):
+        calls.append(message["sqs"]["MessageId"])
+        blocked.wait(5)
+        return message
+
+    service.message_executor = message_executor
+    running_threads, read_msg_ids = service._handle_message_receiving_and_processing()
+
+    # Redelivered while the original runs, so completing it deletes the payload but not the message
+    clock.now = 2
+    assert service._handle_message_receiving_and_processing() == ([], [])
+    blocked.set()
+    service._handle_message_delete_processing(running_threads, read_msg_ids)
+    assert client.s3_client.list_object_keys("bucket") == []
+
+    clock.now = 4
+    service.process_messages()
+
+    assert calls == [read_msg_ids[0]]
+    assert service.metrics.duplicates.value() == 2
+    assert service.metrics.failed.value() == 0
+    clock.now = 10
+    assert "Messages" not in sqs.receive_message(QueueUrl=service.sqs_primary_url)
+
+
+def test_drain_releases_more_messages_than_fit_in_one_batch(sqs):
+    service = _create_service(sqs)
+    service.task_executor_max_thread = 20
+    client = service.sqs_extended_client
+    for index in range(12):
+        client.submit_single_message(queue_url=service.sqs_primary_url, message=f"message {index}")
+    blocked = threading.Event()
+    service.message_executor = lambda message: blocked.wait(5) and message
+    service._handle_message_receiving_and_processing()
+    service._handle_message_receiving_and_processing()
+
+    try:
+        assert service.drain(timeout=0.1) == (0, 12)
+    finally:
+        blocked.set()
+
+    assert len(sqs.receive_message(QueueUrl=service.sqs_primary_url, MaxNumberOfMessages=10)["Messages"]) == 10
+    assert len(sqs.receive_message(QueueUrl=service.sqs_primary_url, MaxNumberOfMessages=10)["Messages"]) == 2
+
+
+def test_drain_deletes_messages_completed_while_others_are_still_running(sqs):
+    service = _create_service(sqs)
+    client = service.sqs_extended_client
+    client.submit_single_message(queue_url=service.sqs_primary_url, message="fast")
+    client.submit_single_message(queue_url=service.sqs_primary_url, message="slow")
+    blocked = threading.Event()
+    service.message_executor = lambda message: (message["s3"] == "fast" or blocked.wait(5)) and message
+    scheduler = threading.Thread(target=service.process_messages)
+    scheduler.start()
+    # Wait for the scheduler thread to pick up the fast message while the slow one is still running
+    deadline = time.monotonic() + 5
+    while (service.metrics.processed.value() < 1 or len(service._in_flight) > 1) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    try:
+        assert service.drain(timeout=0.2) == (1, 1)
+    finally:
+        blocked.set()
+        scheduler.join(5)
+
+    assert service.metrics.deleted.value() == 1
+    messages = client.receive_messages(service.sqs_primary_url, 10)
+    assert [message["s3"] for message in messages] == ["slow"]
+
+
+class AnyTaskExecutorService(TaskExecutorService):
+    def message_executor(self, message):
+        return message
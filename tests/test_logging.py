@@ -1,4 +1,7 @@
+import io
+import itertools
 import json
+import logging
 
 import pytest
 from flask import Flask
@@ -110,3 +113,550 @@ def test_init_app_logging_can_take_custom_logging_config(capsys):
         app.logger.critical("critical")
 
     assert len(capsys.readouterr().out.strip().splitlines()) == 1
+
+
+def test_async_logging_writes_records_from_a_background_thread(capsys):
+    app = Flask("test_app")
+    app.config["FSD_LOG_ASYNC"] = True
+    app.config["FSD_LOG_LEVEL"] = "INFO"
+
+    fsd_logging.init_app(app)
+
+    with app.app_context():
+        app.logger.info("info")
+        app.logger.warning("warning")
+
+    (handler,) = app.logger.handlers
+    assert isinstance(handler, fsd_logging.NonBlockingQueueHandler)
+    handler.flush()
+
+    log_lines = capsys.readouterr().out.strip().splitlines()
+    assert [json.loads(line)["message"] for line in log_lines] == ["Logging configured", "info", "warning"]
+    handler.close()
+
+
+def test_non_blocking_queue_handler_drops_debug_records_first():
+    stream = io.StringIO()
+    handler = fsd_logging.NonBlockingQueueHandler(stream=stream, queue_size=4, debug_headroom=0.5)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    # Stop consuming so the queue fills up
+    handler.listener.stop()
+    test_logger = logging.getLogger("test_non_blocking_queue_handler")
+
+    for level, message in (
+        (logging.DEBUG, "debug 1"),
+        (logging.DEBUG, "debug 2"),
+        (logging.DEBUG, "debug 3"),
+        (logging.INFO, "info 1"),
+        (logging.INFO, "info 2"),
+        (logging.INFO, "info 3"),
+    ):
+        handler.handle(test_logger.makeRecord(test_logger.name, level, __file__, 1, message, (), None))
+
+    assert handler.dropped == 2
+    assert [record.getMessage() for record in list(handler.queue.queue)] == ["debug 1", "debug 2", "info 1", "info 2"]
+
+    handler.listener.start()
+    handler.flush()
+    handler.handle(test_logger.makeRecord(test_logger.name, logging.INFO, __file__, 1, "info 4", (), None))
+    handler.flush()
+    handler.close()
+
+    assert stream.getvalue().splitlines() == [
+        "DEBUG debug 1",
+        "DEBUG debug 2",
+        "INFO info 1",
+        "INFO info 2",
+        "WARNING Dropped 2 log records because the log queue was full",
+        "INFO info 4",
+    ]
+
+
+def _format_json(record_message, **extra):
+    formatter = fsd_logging.JSONFormatter(fmt=fsd_logging.get_json_log_format())
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, record_message, (), None)
+    record.__dict__.update(extra)
+    return json.loads(formatter.format(record))
+
+
+def test_json_formatter_formats_message_with_extra():
+    log = _format_json("{method} {url} {status:d}", method="GET", url="/path", status=200, trace_id="abc")
+
+    assert log["message"] == "GET /path 200"
+    assert log["requestId"] == "abc"
+    assert log["logType"] == "application"
+    assert "trace_id" not in log
+
+
+def test_json_formatter_fills_missing_keys_in_one_pass(mocker):
+    warning = mocker.patch.object(fsd_logging.logger, "warning")
+
+    log = _format_json("{method} {url} {method}", method="GET")
+
+    assert log["message"] == "GET {url: missing key} GET"
+    warning.assert_called_once_with("Missing keys when formatting log message: %s", ("url",))
+
+
+def test_json_formatter_gives_up_with_too_many_missing_keys(mocker):
+    error = mocker.patch.object(fsd_logging.logger, "error")
+
+    log = _format_json("{a} {b} {c} {d} {e}")
+
+    assert log["message"] == "{a} {b} {c} {d} {e}"
+    error.assert_called_once()
+
+
+@pytest.mark.parametrize(
+    "message, expected",
+    (
+        ("no fields", "no fields"),
+        ("escaped {{braces}}", "escaped {braces}"),
+        ("unbalanced {", "unbalanced {"),
+        ("positional {}", "positional {}"),
+        ("attribute {record.name}", "attribute test"),
+    ),
+)
+def test_json_formatter_message_templates(message, expected):
+    assert (
+        _format_json(message, record=logging.LogRecord("test", logging.INFO, "", 1, "", (), None))["message"]
+        == expected
+    )
+
+
+def test_message_template_parse_is_cached():
+    fsd_logging._parse_message_template.cache_clear()
+
+    for _ in range(3):
+        _format_json("{method} request", method="GET")
+
+    cache_info = fsd_logging._parse_message_template.cache_info()
+    assert (cache_info.misses, cache_info.hits) == (1, 2)
+
+
+@pytest.mark.parametrize("serializer", ("json", "orjson"))
+def test_json_serializers_produce_the_same_log(serializer):
+    pytest.importorskip("orjson")
+    formatter = fsd_logging.JSONFormatter(fmt=fsd_logging.get_json_log_format(), serializer=serializer)
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "{status} ünïcode", (), None)
+    record.__dict__.update(status=200, error=ValueError("bad"), counts={1: 2}, huge=2**70)
+
+    assert json.loads(formatter.format(record)) == {
+        "name": "test",
+        "levelname": "INFO",
+        "message": "200 ünïcode",
+        "funcName": None,
+        "pathname": __file__,
+        "lineno": 1,
+        "status": 200,
+        "error": "ValueError: bad",
+        "counts": {"1": 2},
+        "huge": 2**70,
+        "logType": "application",
+    }
+
+
+def test_get_json_serializer(monkeypatch):
+    def custom(log_record):
+        return "custom"
+
+    assert fsd_logging.get_json_serializer(custom) is custom
+    assert fsd_logging.get_json_serializer("json") is fsd_logging.json_serializer
+    with pytest.raises(ValueError):
+        fsd_logging.get_json_serializer("yaml")
+
+    monkeypatch.setattr(fsd_logging, "orjson", None)
+    assert fsd_logging.get_json_serializer() is fsd_logging.json_serializer
+    with pytest.raises(ImportError):
+        fsd_logging.get_json_serializer("orjson")
+
+
+def test_json_formatter_keeps_python_json_logger_options():
+    formatter = fsd_logging.JSONFormatter(fmt="%(message)s", json_indent=2)
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "message", (), None)
+
+    assert formatter.format(record).startswith("{\n")
+
+
+def _plaintext_record(msg="{status} message", levelname="ERROR", **extra):
+    record = logging.LogRecord("test", getattr(logging, levelname), __file__, 1, msg, (), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_custom_log_formatter_fills_missing_fields_and_formats_message():
+    formatter = fsd_logging.CustomLogFormatter("%(levelname)s %(message)s %(endpoint)s", use_color=False)
+
+    assert formatter.format(_plaintext_record(status=500)) == "ERROR 500 message -"
+    assert formatter.format(_plaintext_record("{unknown} message")) == "ERROR {unknown} message -"
+
+
+def test_custom_log_formatter_colours_levelname_without_changing_the_record():
+    formatter = fsd_logging.CustomLogFormatter(fsd_logging.DEV_DEBUG_LOG_FORMAT)
+    record = _plaintext_record(status=500)
+
+    first = formatter.format(record)
+    # A second handler formatting the same record used to fail on the coloured levelname
+    second = formatter.format(record)
+
+    assert first == second
+    assert f"{formatter.RED}ERROR{formatter.RESET} - 500 message - from " in first
+    assert first.endswith("in test_logging.py:1")
+    assert record.levelname == "ERROR"
+    assert not hasattr(record, "endpoint")
+
+
+def test_custom_log_formatter_handles_custom_levels():
+    formatter = fsd_logging.CustomLogFormatter("%(levelname)s %(message)s")
+    record = _plaintext_record("message")
+    record.levelname = "TRACE"
+
+    assert formatter.format(record) == "TRACE message"
+
+
+def _request_logging_app(**config):
+    app = Flask("test_app")
+    app.config.update(config)
+
+    @app.route("/status/<int:status>")
+    def status(status):
+        return "", status
+
+    fsd_logging.init_app(app)
+    return app
+
+
+def _request_log_statuses(capsys):
+    return [json.loads(line).get("status") for line in capsys.readouterr().out.strip().splitlines()]
+
+
+def test_request_logging_builds_context_once_per_request(capsys, mocker):
+    app = _request_logging_app(FSD_LOG_LEVEL="DEBUG")
+    build_context = mocker.spy(fsd_logging, "_common_request_extra_log_context")
+
+    app.test_client().get("/status/200")
+
+    assert build_context.call_count == 1
+    assert _request_log_statuses(capsys) == [None, None, 200]
+
+
+def test_request_logging_skips_disabled_levels(capsys, mocker):
+    app = _request_logging_app(FSD_LOG_LEVEL="WARNING")
+    build_context = mocker.spy(fsd_logging, "_common_request_extra_log_context")
+
+    app.test_client().get("/status/200")
+
+    build_context.assert_not_called()
+    assert capsys.readouterr().out == ""
+
+
+def test_request_logging_samples_successful_requests(capsys, mocker):
+    app = _request_logging_app(FSD_LOG_REQUEST_SAMPLE_RATE=0.5, FSD_LOG_SLOW_REQUEST_SECONDS=None)
+    capsys.readouterr()
+    mocker.patch.object(fsd_logging.random, "random", side_effect=[0.7, 0.2])
+
+    client = app.test_client()
+    client.get("/status/200")
+    client.get("/status/201")
+    client.get("/status/500")
+
+    log_lines = [json.loads(line) for line in capsys.readouterr().out.strip().splitlines()]
+    # Error responses aren't sampled, so scaling them by sample_rate would overcount them
+    assert [(line["status"], line.get("sample_rate")) for line in log_lines] == [(201, 0.5), (500, None)]
+
+
+def test_request_logging_does_not_mark_slow_requests_as_sampled(capsys):
+    app = _request_logging_app(FSD_LOG_REQUEST_SAMPLE_RATE=0.5, FSD_LOG_SLOW_REQUEST_SECONDS=0)
+    capsys.readouterr()
+
+    app.test_client().get("/status/200")
+
+    (log_line,) = [json.loads(line) for line in capsys.readouterr().out.strip().splitlines()]
+    assert log_line["slow"] is True
+    assert "sample_rate" not in log_line
+
+
+def test_request_logging_always_keeps_slow_requests(capsys):
+    app = _request_logging_app(FSD_LOG_REQUEST_SAMPLE_RATE=0, FSD_LOG_SLOW_REQUEST_SECONDS=0)
+    capsys.readouterr()
+
+    app.test_client().get("/status/200")
+
+    assert _request_log_statuses(capsys) == [200]
+
+
+def test_request_logging_does_not_flag_slow_requests_by_default(capsys, mocker):
+    app = _request_logging_app()
+    capsys.readouterr()
+    mocker.patch.object(fsd_logging.time, "perf_counter", side_effect=itertools.count(step=10))
+
+    app.test_client().get("/status/200")
+
+    (log_line,) = [json.loads(line) for line in capsys.readouterr().out.strip().splitlines()]
+    assert (log_line["levelname"], log_line["message"]) == ("INFO", "GET http://localhost/status/200 200")
+    assert "slow" not in log_line
+
+
+def _debug_capture_app(capsys, **config):
+    app = Flask("test_app")
+    app.config.update(FSD_LOG_DEBUG_CAPTURE=5, **config)
+
+    @app.route("/<int:status>")
+    def respond(status):
+        for step in range(10):
+            app.logger.debug("step %s", step)
+        if status == 599:
+            app.logger.error("failed")
+            return "", 200
+        return "", status
+
+    fsd_logging.init_app(app)
+    app.logger.handlers[0].flush()
+    capsys.readouterr()
+    return app
+
+
+def _log_lines(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.strip().splitlines()]
+
+
+def test_debug_capture_discards_debug_records_for_successful_requests(capsys):
+    app = _debug_capture_app(capsys)
+
+    app.test_client().get("/200")
+
+    assert [line["message"] for line in _log_lines(capsys)] == ["GET http://localhost/200 200"]
+
+
+def test_debug_capture_writes_last_debug_records_for_5xx_responses(capsys):
+    app = _debug_capture_app(capsys)
+
+    app.test_client().get("/500")
+
+    log_lines = _log_lines(capsys)
+    assert [line["message"] for line in log_lines] == [
+        "step 5",
+        "step 6",
+        "step 7",
+        "step 8",
+        "step 9",
+        "GET http://localhost/500 500",
+    ]
+    assert all(line["debug_capture"] for line in log_lines[:5])
+
+
+def test_debug_capture_writes_debug_records_before_errors(capsys):
+    app = _debug_capture_app(capsys, FSD_LOG_ASYNC=True)
+
+    app.test_client().get("/599")
+    app.logger.handlers[0].flush()
+
+    assert [line["message"] for line in _log_lines(capsys)] == [
+        "step 5",
+        "step 6",
+        "step 7",
+        "step 8",
+        "step 9",
+        "failed",
+        "GET http://localhost/599 200",
+    ]
+    app.logger.handlers[0].close()
+
+
+class _ViewFrameFilter(fsd_logging.BaseExtraStackLocationFilter):
+    def __init__(self, **kwargs):
+        super().__init__("view_")
+        self.__dict__.update(kwargs)
+        self.checked = 0
+
+    def is_interesting_frame(self, frame):
+        self.checked += 1
+        if frame.f_code.co_name == "_raising_frame":
+            raise ValueError("faulty implementation")
+        return frame.f_code.co_name == "_view"
+
+
+def _log_through(stack_filter, depth=0):
+    def _raising_frame():
+        record = logging.LogRecord("test", logging.INFO, __file__, 1, "message", (), None)
+        stack_filter.filter(record)
+        return record
+
+    def _view(remaining):
+        if remaining:
+            return _view(remaining - 1)
+        return _raising_frame()
+
+    return _view(depth)
+
+
+def test_stack_location_filter_sets_caller_location():
+    record = _log_through(_ViewFrameFilter())
+
+    assert record.view_funcName == "_view"
+    assert record.view_pathname == __file__
+
+
+def test_stack_location_filter_caches_decisions_per_code_object():
+    stack_filter = _ViewFrameFilter()
+
+    _log_through(stack_filter)
+    checked = stack_filter.checked
+    record = _log_through(stack_filter)
+
+    assert checked > 0
+    assert stack_filter.checked == checked
+    assert record.view_funcName == "_view"
+
+
+def test_stack_location_filter_can_disable_the_cache():
+    stack_filter = _ViewFrameFilter(cache_frame_decisions=False)
+
+    _log_through(stack_filter)
+    checked = stack_filter.checked
+    _log_through(stack_filter)
+
+    assert stack_filter.checked == 2 * checked
+
+
+def test_stack_location_filter_caps_the_stack_depth():
+    # The walk starts at _raising_frame, which called filter(), so _view is the second frame
+    record = _log_through(_ViewFrameFilter(max_stack_depth=1))
+    assert not hasattr(record, "view_funcName")
+
+    record = _log_through(_ViewFrameFilter(max_stack_depth=2))
+    assert record.view_funcName == "_view"
+
+
+def _rate_limited_records(rate_limit_filter, count, lineno=1, level=logging.ERROR):
+    records = [logging.LogRecord("test", level, __file__, lineno, "bad answer: %s", (i,), None) for i in range(count)]
+    return [record for record in records if rate_limit_filter.filter(record)]
+
+
+def _summaries(caplog):
+    return [(record.getMessage(), record.lineno, record.suppressed_count) for record in caplog.records]
+
+
+def test_rate_limiting_filter_collapses_repeated_records(caplog):
+    now = [0.0]
+    rate_limit_filter = fsd_logging.RateLimitingFilter(interval=60, clock=lambda: now[0])
+
+    assert [record.getMessage() for record in _rate_limited_records(rate_limit_filter, 5)] == ["bad answer: 0"]
+    assert len(_rate_limited_records(rate_limit_filter, 2, lineno=2)) == 1
+    assert caplog.records == []
+
+    now[0] = 60.0
+    (record,) = _rate_limited_records(rate_limit_filter, 3)
+    assert record.getMessage() == "bad answer: 0"
+    assert not hasattr(record, "suppressed_count")
+    assert _summaries(caplog) == [
+        ("bad answer: 4 [repeated 4 more times]", 1, 4),
+        ("bad answer: 1 [repeated 1 more times]", 2, 1),
+    ]
+    assert len(_rate_limited_records(rate_limit_filter, 1, level=logging.INFO)) == 1
+
+
+def test_rate_limiting_filter_reports_a_flood_that_stops(caplog):
+    now = [0.0]
+    rate_limit_filter = fsd_logging.RateLimitingFilter(interval=60, clock=lambda: now[0])
+    _rate_limited_records(rate_limit_filter, 1000)
+
+    now[0] = 59.0
+    _rate_limited_records(rate_limit_filter, 1, lineno=2, level=logging.INFO)
+    assert caplog.records == []
+
+    # Any record filtered after the window closes reports it
+    now[0] = 60.0
+    _rate_limited_records(rate_limit_filter, 1, lineno=2, level=logging.INFO)
+    assert _summaries(caplog) == [("bad answer: 999 [repeated 999 more times]", 1, 999)]
+    assert caplog.records[0].levelno == logging.ERROR
+
+    caplog.clear()
+    rate_limit_filter.flush_summaries()
+    assert caplog.records == []
+
+
+def test_rate_limiting_filter_flushes_open_windows_when_forced(caplog):
+    rate_limit_filter = fsd_logging.RateLimitingFilter(interval=60, clock=lambda: 0.0)
+    _rate_limited_records(rate_limit_filter, 3)
+
+    rate_limit_filter.flush_summaries()
+    assert caplog.records == []
+
+    rate_limit_filter.flush_summaries(force=True)
+    assert _summaries(caplog) == [("bad answer: 2 [repeated 2 more times]", 1, 2)]
+
+
+def test_rate_limiting_filter_allows_a_burst_and_bounds_call_sites():
+    rate_limit_filter = fsd_logging.RateLimitingFilter(burst=2, max_call_sites=2)
+
+    assert len(_rate_limited_records(rate_limit_filter, 5)) == 2
+    for lineno in range(2, 5):
+        _rate_limited_records(rate_limit_filter, 1, lineno=lineno)
+
+    assert len(rate_limit_filter._call_sites) == 2
+
+
+def _rate_limiting_filter(app):
+    (handler,) = app.logger.handlers
+    (rate_limit_filter,) = [f for f in handler.filters if isinstance(f, fsd_logging.RateLimitingFilter)]
+    return rate_limit_filter
+
+
+def test_default_logging_config_rate_limits_app_logger(capsys):
+    app = Flask("test_app")
+    app.config["FSD_LOG_RATE_LIMITS"] = 60
+    fsd_logging.init_app(app)
+    capsys.readouterr()
+
+    with app.app_context():
+        for answer in range(10):
+            app.logger.error("Error occurred while processing HTML tag: %s", answer)
+
+    assert len(capsys.readouterr().out.strip().splitlines()) == 1
+    _rate_limiting_filter(app).flush_summaries(force=True)
+    (summary,) = [json.loads(line) for line in capsys.readouterr().out.strip().splitlines()]
+    assert summary["message"] == "Error occurred while processing HTML tag: 9 [repeated 9 more times]"
+    assert summary["suppressed_count"] == 9
+    config = get_default_logging_config(app)
+    assert config["filters"]["rate_limit"]["interval"] == {"test_app": 60}
+    assert config["handlers"]["default"]["filters"] == ["request_extra_context", "rate_limit"]
+
+
+def test_rate_limiting_does_not_drop_request_logs(capsys):
+    app = _request_logging_app(FSD_LOG_RATE_LIMITS=60, FSD_LOG_SLOW_REQUEST_SECONDS=0)
+    capsys.readouterr()
+
+    client = app.test_client()
+    for status in (200, 201, 200, 201):
+        client.get(f"/status/{status}")
+
+    assert _request_log_statuses(capsys) == [200, 201, 200, 201]
+
+
+def test_default_logging_config_rate_limits_child_loggers(capsys):
+    app = Flask("test_app")
+    app.config["FSD_LOG_RATE_LIMITS"] = {"test_app": 60, "test_app.mapping": 0}
+    fsd_logging.init_app(app)
+    capsys.readouterr()
+
+    with app.app_context():
+        for answer in range(3):
+            logging.getLogger("test_app.views").warning("Could not find answer %s", answer)
+            logging.getLogger("test_app.mapping.tags").warning("Unknown tag %s", answer)
+
+    messages = [json.loads(line)["message"] for line in capsys.readouterr().out.strip().splitlines()]
+    assert messages == ["Could not find answer 0", "Unknown tag 0", "Unknown tag 1", "Unknown tag 2"]
+    _rate_limiting_filter(app).flush_summaries(force=True)
+    messages = [json.loads(line)["message"] for line in capsys.readouterr().out.strip().splitlines()]
+    assert messages == ["Could not find answer 2 [repeated 2 more times]"]
+
+
+def test_rate_limiting_filter_intervals_per_logger():
+    rate_limit_filter = fsd_logging.RateLimitingFilter(interval={"": 60, "noisy": 0})
+
+    def let_through(logger_name):
+        return rate_limit_filter.filter(logging.LogRecord(logger_name, logging.ERROR, __file__, 1, "bad", (), None))
+
+    assert [let_through("other.child") for _ in range(2)] == [True, False]
+    assert [let_through("noisy.child") for _ in range(2)] == [True, True]
+    assert rate_limit_filter._logger_intervals == {"other.child": 60, "noisy.child": 0}
@@ -0,0 +1,146 @@
+import pytest
+from flask import Flask
+
+from fsd_utils.metrics.endpoint_metrics import EndpointMetrics
+from fsd_utils.metrics.multiprocess import MultiProcessCollector, clear_snapshots
+from fsd_utils.metrics.registry import MetricsRegistry
+
+
+def test_counter_and_gauge_values():
+    registry = MetricsRegistry(prefix="test_")
+    counter = registry.counter("requests_total", "Requests")
+    gauge = registry.gauge("queue_depth", "Queue depth", function=lambda: 3)
+
+    counter.inc()
+    counter.inc(2)
+    counter.inc(status="500")
+
+    assert counter.value() == 3
+    assert counter.value(status="500") == 1
+    assert gauge.value() == 3
+    assert registry.collect()["test_requests_total"] == {(): 3, (("status", "500"),): 1}
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.value() == {
+        "buckets": {0.1: 2, 1: 3, float("inf"): 4},
+        "sum": pytest.approx(5.65),
+        "count": 4,
+    }
+
+
+def test_generate_latest_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests").inc(endpoint='say "hi"')
+    registry.histogram("latency_seconds", "Latency", buckets=(1,)).observe(0.5)
+
+    assert registry.generate_latest() == (
+        "# HELP requests_total Requests\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{endpoint="say \\"hi\\""} 1.0\n'
+        "# HELP latency_seconds Latency\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{le="1.0"} 1.0\n'
+        'latency_seconds_bucket{le="+Inf"} 1.0\n'
+        "latency_seconds_sum 0.5\n"
+        "latency_seconds_count 1.0\n"
+    )
+
+
+def test_duplicate_metric_names_are_rejected():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests")
+
+    with pytest.raises(ValueError):
+        registry.gauge("requests_total", "Requests")
+
+
+def _snapshot_registry(requests):
+    registry = MetricsRegistry(prefix="test_")
+    counter = registry.counter("requests_total", "Requests")
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=(1,))
+    for status, latency in requests:
+        counter.inc(status=status)
+        histogram.observe(latency)
+    return registry
+
+
+def test_multiprocess_collector_merges_process_snapshots(tmp_path, mocker):
+    first = MultiProcessCollector(_snapshot_registry([("200", 0.5), ("500", 2)]), str(tmp_path))
+    second = MultiProcessCollector(_snapshot_registry([("200", 0.1)]), str(tmp_path))
+    getpid = mocker.patch("fsd_utils.metrics.multiprocess.os.getpid", return_value=1)
+    first.flush()
+    getpid.return_value = 2
+
+    snapshot = second.snapshot()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["metrics-1.json", "metrics-2.json"]
+    assert snapshot["test_requests_total"]["values"] == {(("status", "200"),): 2, (("status", "500"),): 1}
+    assert snapshot["test_latency_seconds"]["values"][()] == {
+        "buckets": {1: 2, float("inf"): 3},
+        "sum": pytest.approx(2.6),
+        "count": 3,
+    }
+    assert 'test_requests_total{status="200"} 2.0' in second.generate_latest()
+
+    clear_snapshots(str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_multiprocess_collector_throttles_flushes(tmp_path, mocker):
+    collector = MultiProcessCollector(_snapshot_registry([]), str(tmp_path), flush_interval=60)
+    flush = mocker.spy(collector, "flush")
+
+    collector.maybe_flush()
+    collector.maybe_flush()
+
+    assert flush.call_count == 1
+
+
+def _endpoint_metrics_app(**kwargs):
+    app = Flask("test_app")
+
+    @app.route("/status/<int:status>")
+    def status(status):
+        return "", status
+
+    return app, EndpointMetrics(app, **kwargs)
+
+
+def test_endpoint_metrics_records_latency_and_status_per_endpoint():
+    app, metrics = _endpoint_metrics_app(buckets=(10,))
+    client = app.test_client()
+
+    client.get("/status/200")
+    client.get("/status/500")
+    client.get("/not-found")
+    response = client.get("/metrics")
+
+    assert app.extensions["fsd_endpoint_metrics"] is metrics
+    assert metrics.requests.value(endpoint="status", method="GET", status="200") == 1
+    assert metrics.requests.value(endpoint="status", method="GET", status="500") == 1
+    assert metrics.requests.value(endpoint="unmatched", method="GET", status="404") == 1
+    assert metrics.request_duration.value(endpoint="status", method="GET")["count"] == 2
+    assert response.mimetype == "text/plain"
+    assert 'fsd_http_request_duration_seconds_bucket{endpoint="status",method="GET",le="10.0"} 2.0' in response.text
+    assert "metrics_view" not in response.text
+
+
+def test_endpoint_metrics_aggregates_workers(tmp_path, mocker):
+    other_worker_registry = MetricsRegistry(prefix="fsd_http_")
+    other_worker_registry.counter("requests_total", "Requests").inc(endpoint="status", method="GET", status="200")
+    mocker.patch("fsd_utils.metrics.multiprocess.os.getpid", return_value=-1)
+    MultiProcessCollector(other_worker_registry, str(tmp_path)).flush()
+    mocker.stopall()
+    app, metrics = _endpoint_metrics_app(multiprocess_dir=str(tmp_path))
+
+    app.test_client().get("/status/200")
+    response = app.test_client().get("/metrics")
+
+    assert 'fsd_http_requests_total{endpoint="status",method="GET",status="200"} 2.0' in response.text
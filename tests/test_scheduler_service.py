@@ -0,0 +1,107 @@
+import gc
+import threading
+import weakref
+from unittest.mock import MagicMock
+
+import pytest
+
+from fsd_utils.sqs_scheduler import scheduler_service
+from fsd_utils.sqs_scheduler.scheduler_service import HostLease, ProcessMessagesTrigger, scheduler_executor
+
+
+def _blocking_service():
+    started = threading.Event()
+    release = threading.Event()
+    service = MagicMock()
+    service.draining = threading.Event()
+    service._process_messages_trigger = None
+
+    def process_messages():
+        started.set()
+        release.wait(5)
+
+    service.process_messages = MagicMock(side_effect=process_messages)
+    return service, started, release
+
+
+def test_overlapping_ticks_are_skipped():
+    service, started, release = _blocking_service()
+    trigger = ProcessMessagesTrigger(service)
+    first = threading.Thread(target=trigger)
+    first.start()
+    started.wait(5)
+
+    assert trigger() is False
+    release.set()
+    first.join(5)
+    assert service.process_messages.call_count == 1
+
+
+def test_overlapping_ticks_are_coalesced():
+    service, started, release = _blocking_service()
+    trigger = ProcessMessagesTrigger(service, coalesce=True)
+    first = threading.Thread(target=trigger)
+    first.start()
+    started.wait(5)
+
+    assert trigger() is False
+    assert trigger() is False
+    release.set()
+    first.join(5)
+    assert service.process_messages.call_count == 2
+
+
+def test_host_lease_limits_concurrent_holders(tmp_path):
+    lease = HostLease("test", slots=2, lock_dir=tmp_path)
+
+    with lease.hold() as first, lease.hold() as second, lease.hold() as third:
+        assert (first, second, third) == (True, True, False)
+    with lease.hold() as acquired:
+        assert acquired
+
+
+def test_trigger_skips_when_host_lease_is_taken(tmp_path):
+    service = MagicMock()
+    lease = HostLease("test", slots=1, lock_dir=tmp_path)
+    trigger = ProcessMessagesTrigger(service, host_lease=lease)
+
+    with lease.hold():
+        assert trigger() is False
+    assert trigger() is True
+    assert service.process_messages.call_count == 1
+
+
+def test_scheduler_executor_reuses_trigger_per_service():
+    service, started, release = _blocking_service()
+    first = threading.Thread(target=scheduler_executor, args=(service,))
+    first.start()
+    started.wait(5)
+
+    assert scheduler_executor(service) is False
+    release.set()
+    first.join(5)
+    assert scheduler_executor(service) is True
+
+
+def test_host_lease_needs_fcntl(monkeypatch, tmp_path):
+    monkeypatch.setattr(scheduler_service, "fcntl", None)
+
+    with pytest.raises(NotImplementedError):
+        HostLease("test", lock_dir=tmp_path)
+
+
+def test_scheduler_executor_does_not_keep_the_service_alive():
+    class Service:
+        logger = MagicMock()
+        draining = threading.Event()
+
+        def process_messages(self):
+            pass
+
+    service = Service()
+    assert scheduler_executor(service) is True
+    service_ref = weakref.ref(service)
+
+    del service
+    gc.collect()
+    assert service_ref() is None
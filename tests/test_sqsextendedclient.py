@@ -306,7 +306,7 @@ class TestSQSExtendedClient(unittest.TestCase):
         self.assertEqual(received_messages, messages)
         self.sqs_client.receive_message.assert_called_with(
             QueueUrl=queue_url,
-            AttributeNames=["SentTimestamp", "ApproximateReceiveCount"],
+            AttributeNames=["SentTimestamp", "ApproximateReceiveCount", "MessageDeduplicationId", "MessageGroupId"],
             MessageAttributeNames=["All"],
             MaxNumberOfMessages=max_number,
             VisibilityTimeout=visibility_time,
@@ -348,13 +348,37 @@ class TestSQSExtendedClient(unittest.TestCase):
         self.assertEqual(received_messages[0]["sqs"], messages[0])
         self.sqs_client.receive_message.assert_called_with(
             QueueUrl=queue_url,
-            AttributeNames=["SentTimestamp", "ApproximateReceiveCount"],
+            AttributeNames=["SentTimestamp", "ApproximateReceiveCount", "MessageDeduplicationId", "MessageGroupId"],
             MessageAttributeNames=["All"],
             MaxNumberOfMessages=max_number,
             VisibilityTimeout=visibility_time,
             WaitTimeSeconds=wait_time,
         )
 
+    def test_receive_messages_with_payloads_retrieved_later(self):
+        message_body = json.dumps(
+            [
+                "software.amazon.payloadoffloading.PayloadS3Pointer",
+                {"s3BucketName": "fsd_sqs_extended_helper", "s3Key": str(uuid4())},
+            ]
+        )
+        messages = [{"MessageId": "msg1", "Body": message_body}]
+        self.sqs_client.receive_message.return_value = {
+            "Messages": messages,
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+        }
+        body_data = MagicMock()
+        body_data.read.return_value = b"Testing"
+        self.s3_client.get_object.return_value = {"Body": body_data, "ResponseMetadata": {"HTTPStatusCode": 200}}
+
+        (received_message,) = self.sqs_extended.receive_messages("queue_url", 5, retrieve_payloads=False)
+
+        self.assertEqual(received_message, {"sqs": messages[0], "s3": None})
+        self.s3_client.get_object.assert_not_called()
+        self.assertEqual(self.sqs_extended.retrieve_payload(received_message)["s3"], "Testing")
+        self.assertEqual(self.sqs_extended.retrieve_payload(received_message)["s3"], "Testing")
+        self.s3_client.get_object.assert_called_once()
+
     def test_receive_messages_with_extended_client_behaviour_error_sqs(self):
         # Mock data & responses
         uuid_val = uuid4()
@@ -557,3 +581,66 @@ class TestSQSExtendedClient(unittest.TestCase):
             match="delete_object failed with status code 500",
         ):
             self.sqs_extended.delete_messages(queue_url, message_receipt_handles)
+
+    def test_change_messages_visibility(self):
+        queue_url = "http://localhost:4576/queue/test_queue"
+        messages = [
+            {"MessageId": "msg_id_1", "ReceiptHandle": "receipt_handle1", "Body": "body 1"},
+            {"MessageId": "msg_id_2", "ReceiptHandle": "receipt_handle2", "Body": "body 2"},
+        ]
+        response = {"Successful": [{"Id": "0"}, {"Id": "1"}], "ResponseMetadata": {"HTTPStatusCode": 200}}
+        self.sqs_client.change_message_visibility_batch.return_value = response
+
+        self.assertEqual(self.sqs_extended.change_messages_visibility(queue_url, messages, 0), response)
+        self.sqs_client.change_message_visibility_batch.assert_called_with(
+            QueueUrl=queue_url,
+            Entries=[
+                {"Id": "0", "ReceiptHandle": "receipt_handle1", "VisibilityTimeout": 0},
+                {"Id": "1", "ReceiptHandle": "receipt_handle2", "VisibilityTimeout": 0},
+            ],
+        )
+        self.s3_client.delete_object.assert_not_called()
+
+    def test_change_messages_visibility_error_sqs(self):
+        messages = [{"MessageId": "msg_id_1", "ReceiptHandle": "receipt_handle1", "Body": "body 1"}]
+        self.sqs_client.change_message_visibility_batch.return_value = {"ResponseMetadata": {"HTTPStatusCode": 500}}
+
+        with pytest.raises(
+            SQSExtendedClientException,
+            match="change_messages_visibility failed with status code 500",
+        ):
+            self.sqs_extended.change_messages_visibility("queue_url", messages, 0)
+
+    def test_forward_message(self):
+        message = {
+            "MessageId": "msg_id_1",
+            "ReceiptHandle": "receipt_handle1",
+            "Body": "body 1",
+            "Attributes": {"MessageGroupId": "group"},
+            "MessageAttributes": {"attr1": {"DataType": "String", "StringValue": "value1", "StringListValues": []}},
+        }
+        self.sqs_client.send_message.return_value = {
+            "MessageId": "msg_id_2",
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+        }
+
+        self.assertEqual(self.sqs_extended.forward_message("dlq_url", message), "msg_id_2")
+        self.sqs_client.send_message.assert_called_with(
+            QueueUrl="dlq_url",
+            MessageBody="body 1",
+            MessageAttributes={"attr1": {"DataType": "String", "StringValue": "value1"}},
+            MessageGroupId="group",
+            MessageDeduplicationId="msg_id_1",
+        )
+        self.s3_client.put_object.assert_not_called()
+
+    def test_delete_messages_keeping_payload(self):
+        messages = [{"MessageId": "msg_id_1", "ReceiptHandle": "receipt_handle1", "Body": "body 1"}]
+        self.sqs_client.delete_message_batch.return_value = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+        self.sqs_extended.delete_messages("queue_url", messages, delete_payload=False)
+
+        self.sqs_client.delete_message_batch.assert_called_with(
+            QueueUrl="queue_url", Entries=[{"Id": "0", "ReceiptHandle": "receipt_handle1"}]
+        )
+        self.s3_client.delete_object.assert_not_called()
@@ -1,15 +1,29 @@
+import os
+import signal
+import threading
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from uuid import uuid4
 
 import boto3
 from moto import mock_aws
 
 from fsd_utils.sqs_scheduler.context_aware_executor import ContextAwareExecutor
+from fsd_utils.sqs_scheduler.exceptions import PoisonMessageError, TransientMessageError
+from fsd_utils.sqs_scheduler.idempotency_cache import (
+    COMPLETED,
+    IN_FLIGHT,
+    MessageIdempotencyCache,
+    get_message_keys,
+)
 from fsd_utils.sqs_scheduler.task_executer_service import TaskExecutorService
 
 
 class TestTaskExecutorService(unittest.TestCase):
+    def setUp(self):
+        original_sigterm_handler = signal.getsignal(signal.SIGTERM)
+        self.addCleanup(signal.signal, signal.SIGTERM, original_sigterm_handler)
+
     @mock_aws
     def test_message_in_mock_environment_processing(self):
         """
@@ -22,6 +36,170 @@ class TestTaskExecutorService(unittest.TestCase):
         self.task_executor.process_messages()
 
         self._check_is_data_available(0)
+        metrics = self.task_executor.metrics
+        assert metrics.received.value() == 1
+        assert metrics.processed.value() == 1
+        assert metrics.deleted.value() == 1
+        assert metrics.failed.value() == 0
+        assert metrics.in_flight.value() == 0
+        assert metrics.receive_to_complete.value()["count"] == 1
+        assert metrics.s3_fetch_time.value()["count"] == 1
+        assert "fsd_sqs_messages_processed_total 1.0" in metrics.generate_latest()
+
+    @mock_aws
+    def test_failed_messages_are_released_for_redelivery(self):
+        self._mock_aws_client()
+        sqs_message = {"MessageId": "msg1", "ReceiptHandle": "handle1", "Body": "body"}
+        self.task_executor.message_executor = MagicMock(side_effect=[Exception("failed"), sqs_message])
+        self.task_executor.sqs_extended_client.receive_messages = MagicMock(
+            return_value=[{"sqs": sqs_message, "s3": "message"}]
+        )
+        self.task_executor.sqs_extended_client.delete_messages = MagicMock()
+
+        self.task_executor.process_messages()
+        self.task_executor.process_messages()
+
+        assert self.task_executor.message_executor.call_count == 2
+
+    @mock_aws
+    def test_drain_deletes_completed_and_releases_unfinished_messages(self):
+        self._mock_aws_client()
+        release = threading.Event()
+        finished = {"MessageId": "msg1", "ReceiptHandle": "handle1", "Body": "body"}
+        unfinished = {"MessageId": "msg2", "ReceiptHandle": "handle2", "Body": "body"}
+
+        def message_executor(message):
+            if message["sqs"]["MessageId"] == "msg2":
+                release.wait(5)
+            return message
+
+        self.task_executor.message_executor = message_executor
+        self.task_executor.sqs_extended_client.receive_messages = MagicMock(
+            return_value=[{"sqs": finished, "s3": "message"}, {"sqs": unfinished, "s3": "message"}]
+        )
+        self.task_executor.sqs_extended_client.delete_messages = MagicMock()
+        self.task_executor.sqs_extended_client.change_messages_visibility = MagicMock()
+        running_threads, read_msg_ids = self.task_executor._handle_message_receiving_and_processing()
+
+        assert self.task_executor.drain(timeout=0.2) == (1, 1)
+        release.set()
+        self.task_executor._handle_message_delete_processing(running_threads, read_msg_ids)
+
+        self.task_executor.sqs_extended_client.delete_messages.assert_called_once_with(
+            self.queue_response["QueueUrl"], [finished]
+        )
+        self.task_executor.sqs_extended_client.change_messages_visibility.assert_called_once_with(
+            self.queue_response["QueueUrl"], [unfinished], 0
+        )
+
+    @mock_aws
+    def test_no_messages_are_read_while_draining(self):
+        self._mock_aws_client()
+        self.task_executor.sqs_extended_client.receive_messages = MagicMock()
+        self.task_executor.drain(timeout=0)
+
+        self.task_executor.process_messages()
+
+        self.task_executor.sqs_extended_client.receive_messages.assert_not_called()
+
+    @mock_aws
+    def test_drain_signal_handler_drains_and_calls_the_previous_handler(self):
+        self._mock_aws_client()
+        self.task_executor.drain = MagicMock()
+        previous_handler_calls = []
+        # A plain function, as signal.signal treats a MagicMock as an int
+        signal.signal(signal.SIGTERM, lambda signum, frame: previous_handler_calls.append(signum))
+
+        self.task_executor.register_drain_signal_handler(timeout=5)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+        self.task_executor.drain.assert_called_once_with(5)
+        assert previous_handler_calls == [signal.SIGTERM]
+
+    @mock_aws
+    def test_drain_signal_handler_restores_the_default_behaviour(self):
+        self._mock_aws_client()
+        self.task_executor.drain = MagicMock()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.task_executor.register_drain_signal_handler(timeout=5)
+
+        with patch.object(os, "kill") as kill:
+            signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+
+        self.task_executor.drain.assert_called_once_with(5)
+        # The default handler is put back and the signal sent again, so the process still exits
+        assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+        kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
+
+    @mock_aws
+    def test_drain_signal_handler_ignores_an_ignored_signal(self):
+        self._mock_aws_client()
+        self.task_executor.drain = MagicMock()
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        self.task_executor.register_drain_signal_handler(timeout=5)
+        handler = signal.getsignal(signal.SIGTERM)
+
+        with patch.object(os, "kill") as kill:
+            handler(signal.SIGTERM, None)
+
+        self.task_executor.drain.assert_called_once_with(5)
+        kill.assert_not_called()
+        assert signal.getsignal(signal.SIGTERM) is handler
+
+    @mock_aws
+    def test_transient_errors_are_retried_in_process(self):
+        self._mock_aws_client()
+        sqs_message = {"MessageId": "msg1", "ReceiptHandle": "handle1", "Body": "body"}
+        message = {"sqs": sqs_message, "s3": "message"}
+        self.task_executor.max_retries = 2
+        self.task_executor.retry_backoff = 0
+        self.task_executor.message_executor = MagicMock(
+            side_effect=[TransientMessageError("timeout"), TransientMessageError("timeout"), message]
+        )
+        self.task_executor.sqs_extended_client.receive_messages = MagicMock(return_value=[message])
+        self.task_executor.sqs_extended_client.change_messages_visibility = MagicMock()
+        self.task_executor.sqs_extended_client.delete_messages = MagicMock()
+
+        self.task_executor.process_messages()
+
+        assert self.task_executor.message_executor.call_count == 3
+        assert self.task_executor.sqs_extended_client.change_messages_visibility.call_count == 2
+        self.task_executor.sqs_extended_client.delete_messages.assert_called_once_with(
+            self.queue_response["QueueUrl"], [sqs_message]
+        )
+
+    @mock_aws
+    def test_non_transient_errors_are_not_retried(self):
+        self._mock_aws_client()
+        message = {"sqs": {"MessageId": "msg1", "ReceiptHandle": "handle1", "Body": "body"}, "s3": "message"}
+        self.task_executor.max_retries = 2
+        self.task_executor.message_executor = MagicMock(side_effect=ValueError("bad"))
+        self.task_executor.sqs_extended_client.receive_messages = MagicMock(return_value=[message])
+        self.task_executor.sqs_extended_client.delete_messages = MagicMock()
+
+        self.task_executor.process_messages()
+
+        assert self.task_executor.message_executor.call_count == 1
+        self.task_executor.sqs_extended_client.delete_messages.assert_not_called()
+
+    @mock_aws
+    def test_poison_messages_are_moved_to_the_dlq(self):
+        self._mock_aws_client()
+        sqs_message = {"MessageId": "msg1", "ReceiptHandle": "handle1", "Body": "body"}
+        self.task_executor.sqs_dlq_url = "dlq_url"
+        self.task_executor.message_executor = MagicMock(side_effect=PoisonMessageError("invalid"))
+        self.task_executor.sqs_extended_client.receive_messages = MagicMock(
+            return_value=[{"sqs": sqs_message, "s3": "message"}]
+        )
+        self.task_executor.sqs_extended_client.forward_message = MagicMock()
+        self.task_executor.sqs_extended_client.delete_messages = MagicMock()
+
+        self.task_executor.process_messages()
+
+        self.task_executor.sqs_extended_client.forward_message.assert_called_once_with("dlq_url", sqs_message)
+        self.task_executor.sqs_extended_client.delete_messages.assert_called_once_with(
+            self.queue_response["QueueUrl"], [sqs_message], delete_payload=False
+        )
 
     def _mock_aws_client(self):
         """
@@ -83,6 +261,38 @@ class TestTaskExecutorService(unittest.TestCase):
         assert len(response) == count
 
 
+class TestMessageIdempotencyCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = MessageIdempotencyCache(max_size=2, ttl=10, clock=lambda: self.now)
+
+    def test_claim_returns_the_state_of_known_keys_until_ttl_expires(self):
+        assert self.cache.claim([("MessageId", "a")]) is None
+        assert self.cache.claim([("MessageId", "a")]) == IN_FLIGHT
+        self.cache.complete([("MessageId", "a")])
+        assert self.cache.claim([("MessageId", "a")]) == COMPLETED
+        self.now = 11
+        assert self.cache.claim([("MessageId", "a")]) is None
+
+    def test_claim_prefers_completed_across_keys(self):
+        self.cache.complete([("MessageDeduplicationId", "dedup")])
+        assert self.cache.claim([("MessageId", "a"), ("MessageDeduplicationId", "dedup")]) == COMPLETED
+
+    def test_release_and_max_size(self):
+        assert self.cache.claim([("MessageId", "a")]) is None
+        self.cache.release([("MessageId", "a")])
+        assert self.cache.claim([("MessageId", "a")]) is None
+        assert self.cache.claim([("MessageId", "b")]) is None
+        assert self.cache.claim([("MessageId", "c")]) is None
+        assert len(self.cache) == 2
+        assert ("MessageId", "a") not in self.cache
+
+    def test_get_message_keys_includes_deduplication_id(self):
+        message = {"MessageId": "a", "Attributes": {"MessageDeduplicationId": "dedup"}}
+        assert get_message_keys(message) == [("MessageId", "a"), ("MessageDeduplicationId", "dedup")]
+        assert get_message_keys({"MessageId": "a"}) == [("MessageId", "a")]
+
+
 class AnyTaskExecutorService(TaskExecutorService):
     def message_executor(self, message):
         return message
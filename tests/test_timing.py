@@ -0,0 +1,109 @@
+import json
+
+from flask import Flask
+
+from fsd_utils.logging import logging as fsd_logging
+from fsd_utils.logging.timing import (
+    EndpointLatencySummary,
+    RequestTiming,
+    format_server_timing,
+    get_request_spans,
+    record_span,
+    span,
+)
+
+
+def _create_app():
+    app = Flask("test_app")
+
+    @app.route("/")
+    def index():
+        with span("db"):
+            pass
+        record_span("db", 0.01)
+        record_span("render html", 0.002)
+        return "ok"
+
+    return app
+
+
+def test_server_timing_header_includes_spans_and_total():
+    app = _create_app()
+    RequestTiming(app)
+
+    response = app.test_client().get("/")
+
+    metrics = [metric.split(";dur=") for metric in response.headers["Server-Timing"].split(", ")]
+    assert [name for name, _ in metrics] == ["db", "render_html", "total"]
+    assert float(metrics[0][1]) >= 10.0
+    assert float(metrics[1][1]) == 2.0
+
+
+def test_server_timing_header_can_be_disabled():
+    app = _create_app()
+    RequestTiming(app, server_timing_header=False)
+
+    assert "Server-Timing" not in app.test_client().get("/").headers
+
+
+def test_server_timing_header_is_skipped_without_timings():
+    app = Flask("test_app")
+
+    @app.before_request
+    def short_circuit():
+        # Runs before RequestTiming's handler, so there is no start time or spans
+        return "blocked"
+
+    RequestTiming(app)
+
+    assert "Server-Timing" not in app.test_client().get("/").headers
+
+
+def test_spans_are_ignored_outside_a_request():
+    with span("db"):
+        record_span("http", 1)
+
+    assert get_request_spans() == {}
+
+
+def test_format_server_timing():
+    assert format_server_timing({"db": 0.0125}, total=0.0201) == "db;dur=12.5, total;dur=20.1"
+    assert format_server_timing({}) == ""
+
+
+def test_endpoint_latency_summary_keeps_a_rolling_window():
+    summary = EndpointLatencySummary(window=100)
+    for duration in range(200):
+        summary.record("index", duration / 1000)
+
+    index_summary = summary.summary()["index"]
+
+    assert index_summary["count"] == 100
+    assert index_summary["p50"] == 0.15
+    assert index_summary["max"] == 0.199
+
+
+def test_request_timing_records_endpoint_latency():
+    app = _create_app()
+    timing = RequestTiming(app, endpoint_latency_window=10)
+
+    client = app.test_client()
+    client.get("/")
+    client.get("/")
+
+    assert app.extensions["fsd_request_timing"] is timing
+    assert timing.endpoint_latency.summary()["index"]["count"] == 2
+
+
+def test_slow_requests_are_logged_as_warnings_with_spans(capsys):
+    app = _create_app()
+    app.config.update(FSD_LOG_LEVEL="WARNING", FSD_LOG_SLOW_REQUEST_SECONDS=0)
+    fsd_logging.init_app(app)
+
+    app.test_client().get("/")
+
+    (log_line,) = [json.loads(line) for line in capsys.readouterr().out.strip().splitlines()]
+    assert log_line["levelname"] == "WARNING"
+    assert log_line["message"].startswith("Slow request GET http://localhost/ 200")
+    assert log_line["slow"] is True
+    assert set(log_line["spans"]) == {"db", "render html"}
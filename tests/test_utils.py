@@ -1,4 +1,18 @@
-from fsd_utils.authentication.utils import get_highest_role_map
+from pathlib import Path
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from flask import current_app
+
+from fsd_utils.authentication.utils import (
+    PublicKeyLoader,
+    PublicKeySet,
+    TokenCache,
+    get_highest_role_map,
+    token_cache,
+    validate_token_rs256,
+)
 
 
 def test_get_highest_role_map():
@@ -24,3 +38,113 @@ def test_get_highest_role_map():
         "NSTF": "LEAD_ASSESSOR",
         "MOCKFUND": "COMMENTER",
     }
+
+
+def test_token_cache_expires_at_exp_claim():
+    now = [100]
+    cache = TokenCache(clock=lambda: now[0])
+    cache.set("token", "key", {"accountId": "a", "exp": 110})
+
+    assert cache.get("token", "key") == {"accountId": "a", "exp": 110}
+    now[0] = 110
+    assert cache.get("token", "key") is None
+
+
+def test_token_cache_is_flushed_when_key_changes():
+    cache = TokenCache()
+    cache.set("token", "key", {"accountId": "a"})
+    cache.set("other", "new-key", {"accountId": "b"})
+
+    assert cache.get("token", "key") is None
+    assert cache.get("token", "new-key") is None
+    assert cache.get("other", "new-key") == {"accountId": "b"}
+
+
+def test_token_cache_evicts_least_recently_used():
+    cache = TokenCache(max_size=2)
+    cache.set("a", "key", {})
+    cache.set("b", "key", {})
+    cache.get("a", "key")
+    cache.set("c", "key", {})
+
+    assert len(cache) == 2
+    assert cache.get("b", "key") is None
+    assert cache.get("a", "key") == {}
+
+
+def _read_key(name):
+    return (Path(__file__).parent / "keys/rsa256" / name).read_bytes()
+
+
+def _public_pem(private_pem):
+    return (
+        serialization.load_pem_private_key(private_pem, password=None)
+        .public_key()
+        .public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    )
+
+
+def test_validate_token_rs256_uses_cache(app_context, mocker):
+    current_app.config["RSA256_PUBLIC_KEY"] = _read_key("public.pem")
+    token = jwt.encode({"accountId": "a"}, _read_key("private.pem"), algorithm="RS256")
+    token_cache.clear()
+    decode = mocker.spy(jwt, "decode")
+
+    assert validate_token_rs256(token) == {"accountId": "a"}
+    assert validate_token_rs256(token) == {"accountId": "a"}
+    assert decode.call_count == 1
+
+    current_app.config["RSA256_PUBLIC_KEY"] = _public_pem(_read_key("private_invalid.pem"))
+    with pytest.raises(jwt.InvalidSignatureError):
+        validate_token_rs256(token)
+
+
+def test_validate_token_rs256_selects_key_by_kid(app_context):
+    old_private, new_private = _read_key("private.pem"), _read_key("private_invalid.pem")
+    current_app.config["RSA256_PUBLIC_KEY"] = _read_key("public.pem")
+    current_app.config["RSA256_PUBLIC_KEYS"] = {"old": _read_key("public.pem"), "new": _public_pem(new_private)}
+
+    new_token = jwt.encode({"accountId": "new"}, new_private, algorithm="RS256", headers={"kid": "new"})
+    old_token = jwt.encode({"accountId": "old"}, old_private, algorithm="RS256", headers={"kid": "old"})
+    unknown_kid_token = jwt.encode({"accountId": "default"}, old_private, algorithm="RS256", headers={"kid": "x"})
+
+    assert validate_token_rs256(new_token) == {"accountId": "new"}
+    assert validate_token_rs256(old_token) == {"accountId": "old"}
+    assert validate_token_rs256(unknown_kid_token) == {"accountId": "default"}
+
+
+def test_public_key_loader_parses_pems_once_per_value():
+    pem = _read_key("public.pem")
+    loader = PublicKeyLoader()
+
+    key_set = loader.load(pem, {"kid": pem})
+
+    assert not isinstance(key_set.get(), bytes)
+    assert key_set.get("kid") is not key_set.get()
+    assert loader.load(bytes(pem), {"kid": bytes(pem)}) is key_set
+    assert loader.load(pem, {}) is not key_set
+
+
+def test_public_key_set_without_default_rejects_unknown_kid():
+    with pytest.raises(jwt.InvalidKeyError):
+        PublicKeySet(keys_by_kid={"kid": "key"}).get("other")
+
+
+def test_get_highest_role_map_is_memoized_and_copied():
+    roles = ["COF_COMMENTER", "COF_ASSESSOR", "NSTF_COMMENTER"]
+
+    first = get_highest_role_map(roles)
+    first["COF"] = "CHANGED"
+
+    assert get_highest_role_map(list(roles)) == {"COF": "ASSESSOR", "NSTF": "COMMENTER"}
+
+
+def test_get_highest_role_map_keeps_the_order_of_the_roles():
+    roles = ["NSTF_COMMENTER", "COF_ASSESSOR", "DPIF_LEAD_ASSESSOR"]
+
+    assert list(get_highest_role_map(roles)) == ["NSTF", "COF", "DPIF"]
+    assert list(get_highest_role_map(list(reversed(roles)))) == ["DPIF", "COF", "NSTF"]
+
+
+def test_get_highest_role_map_ignores_unknown_sub_roles():
+    assert get_highest_role_map(["MY_FUND_ASSESSOR", "COF_ASSESSOR"]) == {"COF": "ASSESSOR"}